@@ -1,12 +1,18 @@
 import os
+import copy
+import queue
+import atexit
+import json
 import time
 import asyncio
+import hashlib
 import logging
+import threading
 import traceback
 from collections import OrderedDict
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from functools import wraps
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 from flask import Flask, request, jsonify, Response
 from flask_cors import CORS
@@ -15,12 +21,24 @@ from prometheus_client import Counter, Histogram, generate_latest, REGISTRY
 
 from utils.validator import validate_countries, UNKNOWN_COUNTRY_CODE
 from utils.gemini_detector import GeminiDetector
+from utils.gemini_detector_service import VALID_MODELS
+
+# Optional shared cache backend
+try:
+    import redis
+except ImportError:
+    redis = None
 
 # --- Configuration & Logging Setup ---
 load_dotenv()
 
 def setup_logger():
-    """Configure application logging."""
+    """
+    Configure application logging.
+    
+    Handlers run on a QueueListener thread; the root logger only enqueues records, so
+    request threads and the async loop (including utils.* modules) never wait on log I/O.
+    """
     log_level = os.getenv('LOG_LEVEL', 'INFO')
     logger = logging.getLogger(__name__)
     logger.setLevel(getattr(logging, log_level))
@@ -29,11 +47,17 @@ def setup_logger():
     
     console = logging.StreamHandler()
     console.setFormatter(formatter)
-    logger.addHandler(console)
     
     file_handler = RotatingFileHandler('app.log', maxBytes=10*1024*1024, backupCount=5)
     file_handler.setFormatter(formatter)
-    logger.addHandler(file_handler)
+    
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, console, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)  # Flush queued records on shutdown
+    
+    # Module loggers (this one included) propagate to root
+    logging.getLogger().addHandler(QueueHandler(log_queue))
     return logger
 
 logger = setup_logger()
@@ -41,6 +65,8 @@ logger = setup_logger()
 # --- Metrics ---
 REQUEST_COUNT = Counter('api_requests_total', 'Total API requests', ['endpoint', 'status'])
 REQUEST_LATENCY = Histogram('api_request_duration_seconds', 'API request latency')
+CACHE_HITS = Counter('result_cache_hits_total', 'Result cache hits', ['backend'])
+CACHE_MISSES = Counter('result_cache_misses_total', 'Result cache misses', ['backend'])
 
 # --- Cache Implementation ---
 class LRUCache:
@@ -50,21 +76,100 @@ class LRUCache:
         self.max_size = max_size
 
     def get(self, key: str) -> Any:
-        return self.cache.get(key)
+        value = self.cache.get(key)
+        if value is None:
+            CACHE_MISSES.labels('memory').inc()
+            return None
+        CACHE_HITS.labels('memory').inc()
+        # Callers mutate the returned attributes, so never hand out the stored object
+        return copy.deepcopy(value)
 
     def set(self, key: str, value: Any):
         self.cache[key] = value
         if len(self.cache) > self.max_size:
             self.cache.popitem(last=False)
 
+    def clear(self) -> int:
+        count = len(self.cache)
+        self.cache.clear()
+        return count
+
+class RedisCache:
+    """Redis-backed cache shared by all worker processes, with per-entry TTL."""
+    def __init__(self, client, ttl_seconds: int = 86400, prefix: str = "detect-product:"):
+        self.client = client
+        self.ttl_seconds = ttl_seconds
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return self.prefix + hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> Any:
+        try:
+            raw = self.client.get(self._key(key))
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache read failed: {e}")
+            return None
+        if raw is None:
+            CACHE_MISSES.labels('redis').inc()
+            return None
+        CACHE_HITS.labels('redis').inc()
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any):
+        try:
+            self.client.set(self._key(key), json.dumps(value, ensure_ascii=False), ex=self.ttl_seconds)
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache write failed: {e}")
+
+    def clear(self) -> Optional[int]:
+        """Delete every entry under the prefix; None if Redis failed (some keys may be gone)."""
+        count = 0
+        try:
+            for key in self.client.scan_iter(match=self.prefix + '*', count=500):
+                count += self.client.delete(key)
+        except redis.RedisError as e:
+            logger.warning(f"Redis cache clear failed after {count} keys: {e}")
+            return None
+        return count
+
+def create_result_cache():
+    """Use Redis when REDIS_URL is set and reachable, otherwise an in-process LRU."""
+    redis_url = os.getenv('REDIS_URL')
+    if redis_url:
+        if redis is None:
+            logger.warning("REDIS_URL is set but the 'redis' package is not installed; using in-memory cache")
+        else:
+            try:
+                client = redis.Redis.from_url(redis_url)
+                client.ping()
+                logger.info("✓ Using Redis result cache")
+                return RedisCache(client, ttl_seconds=int(os.getenv('CACHE_TTL_SECONDS', '86400')))
+            except redis.RedisError as e:
+                logger.warning(f"Redis unavailable ({e}); using in-memory cache")
+    return LRUCache(max_size=1000)
+
+# --- Async Runtime ---
+# A single long-lived event loop per worker process. Detectors are shared across
+# requests (GeminiDetector.get), and their gRPC channels are bound to the loop they
+# were first used on, so every coroutine must run on this same loop.
+_event_loop = asyncio.new_event_loop()
+threading.Thread(target=_event_loop.run_forever, name="async-runtime", daemon=True).start()
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and block until it completes."""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop).result()
+
 # --- App Initialization ---
 app = Flask(__name__)
 CORS(app)
-result_cache = LRUCache(max_size=1000)
+result_cache = create_result_cache()
 
 # Initialize Gemini Detector
 try:
-    ai_detector = GeminiDetector()
+    ai_detector = GeminiDetector.get()
+    # Connect in the background so the first request doesn't pay the handshake
+    asyncio.run_coroutine_threadsafe(ai_detector.warmup(), _event_loop)
 except ValueError as e:
     logger.error(f"Failed to initialize Gemini Detector: {e}")
     ai_detector = None
@@ -135,8 +240,9 @@ def health_check():
 @require_api_key
 def clear_cache():
     """Clear all cached results."""
-    items_count = len(result_cache.cache)
-    result_cache.cache.clear()
+    items_count = result_cache.clear()
+    if items_count is None:
+        return api_response(False, errors=[{"code": "CACHE_ERROR", "message": "Cache backend unavailable; the cache may be only partially cleared."}], status=503)
     logger.info(f"Cache cleared: {items_count} items removed")
     return jsonify({
         "result": "OK",
@@ -198,17 +304,31 @@ def detect_product():
         )
     
     # Reject empty model string
-    if custom_model is not None and not custom_model.strip():
+    if custom_model is not None and (not isinstance(custom_model, str) or not custom_model.strip()):
         REQUEST_COUNT.labels('detect-product', 'error').inc()
         return api_response(
             False, 
             errors=[{
                 "code": "VALIDATION_ERROR", 
-                "message": "Parameter 'model' cannot be empty. Provide a valid model name or omit the parameter."
+                "message": "Parameter 'model' must be a non-empty string. Provide a valid model name or omit the parameter."
             }], 
             status=400
         )
     
+    # Only known models: each distinct name gets its own long-lived detector
+    if custom_model is not None:
+        custom_model = custom_model.strip()
+        if custom_model not in VALID_MODELS:
+            REQUEST_COUNT.labels('detect-product', 'error').inc()
+            return api_response(
+                False, 
+                errors=[{
+                    "code": "VALIDATION_ERROR", 
+                    "message": f"Model '{custom_model}' is not supported. Valid models: {', '.join(sorted(VALID_MODELS))}"
+                }], 
+                status=400
+            )
+    
     # Generate cache key
     cache_key = _generate_cache_key(title, description)
     
@@ -221,12 +341,12 @@ def detect_product():
 
     # Process with AI
     try:
-        detector = GeminiDetector(model_name=custom_model)
+        detector = GeminiDetector.get(custom_model)
         
         log_msg = f"Processing: title='{title[:30]}...', desc='{description[:30]}...' [Model: {detector.model_name}]"
         logger.info(log_msg)
         
-        ai_result = asyncio.run(detector.detect_product(title=title, description=description))
+        ai_result = run_async(detector.detect_product(title=title, description=description))
         
         # Handle AI errors
         if "error" in ai_result:
@@ -381,26 +501,40 @@ def batch_detect_product():
             )
     
     # Reject empty model string
-    if custom_model is not None and not custom_model.strip():
+    if custom_model is not None and (not isinstance(custom_model, str) or not custom_model.strip()):
         REQUEST_COUNT.labels('batch-detect-product', 'error').inc()
         return api_response(
             False, 
             errors=[{
                 "code": "VALIDATION_ERROR", 
-                "message": "Parameter 'model' cannot be empty. Provide a valid model name or omit the parameter."
+                "message": "Parameter 'model' must be a non-empty string. Provide a valid model name or omit the parameter."
             }], 
             status=400
         )
+    
+    # Only known models: each distinct name gets its own long-lived detector
+    if custom_model is not None:
+        custom_model = custom_model.strip()
+        if custom_model not in VALID_MODELS:
+            REQUEST_COUNT.labels('batch-detect-product', 'error').inc()
+            return api_response(
+                False, 
+                errors=[{
+                    "code": "VALIDATION_ERROR", 
+                    "message": f"Model '{custom_model}' is not supported. Valid models: {', '.join(sorted(VALID_MODELS))}"
+                }], 
+                status=400
+            )
 
-    async def _run_batch():
-        """Inner async function to process batch requests."""
-        tasks = []
+    def _run_batch():
+        """Process batch requests; cache lookups stay off the event loop, AI calls run on it."""
+        pending = []
         indices_needing_ai = []
         results = [None] * len(items)
         
         # Create detector instance for batch processing
         try:
-            detector = GeminiDetector(model_name=custom_model)
+            detector = GeminiDetector.get(custom_model)
         except ValueError as e:
             logger.error(f"Detector initialization error in batch: {str(e)}")
             raise
@@ -414,12 +548,12 @@ def batch_detect_product():
             if cached:
                 results[i] = {"attributes": cached['attributes'], "cache": True}
             else:
-                tasks.append(detector.detect_product(title=title, description=desc))
+                pending.append((title, desc))
                 indices_needing_ai.append((i, cache_key))
 
-        if tasks:
-            logger.info(f"Processing {len(tasks)} items with Vertex AI [Model: {detector.model_name}]")
-            ai_outputs = await asyncio.gather(*tasks)
+        if pending:
+            logger.info(f"Processing {len(pending)} items with Vertex AI [Model: {detector.model_name}]")
+            ai_outputs = run_async(detector.detect_products_batch(pending))
             
             for (idx, cache_key), output in zip(indices_needing_ai, ai_outputs):
                 # Check for errors in AI output
@@ -452,10 +586,10 @@ def batch_detect_product():
                     "cache": False
                 }
         
-        return results, len(tasks), detector.model_name
+        return results, len(pending), detector.model_name
 
     try:
-        results, ai_calls, model_name = asyncio.run(_run_batch())
+        results, ai_calls, model_name = _run_batch()
         processing_time = int((time.time() - start_time) * 1000)
         
         response_data = {
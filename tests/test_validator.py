@@ -0,0 +1,23 @@
+from utils.validator import country_name_to_alpha2, find_country_name
+
+
+def test_usa_aliases_resolve_to_us():
+    assert country_name_to_alpha2("USA") == "US"
+    assert country_name_to_alpha2("u.s.a.") == "US"
+    assert find_country_name("made in USA") == "US"
+    assert find_country_name("Made in U.S.A.") == "US"
+
+
+def test_ascii_names_match_whole_words_only():
+    assert find_country_name("woman") is None
+    assert find_country_name("roman") is None
+    assert find_country_name("indiana") is None
+    assert find_country_name("ukrainian") is None
+
+
+def test_demonyms_and_cjk_suffixes_still_match():
+    assert find_country_name("Japanese") == "JP"
+    assert find_country_name("Omani") == "OM"
+    assert find_country_name("japan製") == "JP"
+    assert find_country_name("日本製") == "JP"
+    assert find_country_name("インドネシア製") == "ID"
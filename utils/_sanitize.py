@@ -0,0 +1,34 @@
+"""
+Whitespace sanitization kernels for detector output.
+
+Kept free of project imports and fully type-annotated so it can be compiled
+with mypyc. The Docker image does this at build time (`cd utils && mypyc
+_sanitize.py`; utils has no __init__.py, so it must run from inside utils), and
+Python then imports the compiled extension in place of this file. Everywhere
+else, e.g. local runs, this file is used as plain Python.
+"""
+import re
+from typing import Any, Dict, List
+
+# Whitespace folded to a plain space before collapsing runs (single C-level pass).
+# Exactly the characters \s matches (str.isspace), so the '  ' check below never misses a run
+_WS_CHARS = (
+    '\t\n\v\f\r\x1c\x1d\x1e\x1f\x85\u00a0\u1680'
+    + ''.join(chr(c) for c in range(0x2000, 0x200b))  # En quad .. hair space
+    + '\u2028\u2029\u202f\u205f\u3000'
+)
+WS_TABLE: Dict[int, str] = str.maketrans({ch: ' ' for ch in _WS_CHARS})
+_WS_RE = re.compile(r'\s+')
+
+
+def normalize_whitespace(value: str) -> str:
+    """Fold newlines/tabs to spaces and collapse runs; the regex only runs when a run exists."""
+    cleaned = value.translate(WS_TABLE)
+    if '  ' in cleaned:
+        cleaned = _WS_RE.sub(' ', cleaned)
+    return cleaned.strip()
+
+
+def normalize_list(values: List[Any]) -> List[Any]:
+    """Fold whitespace in each string item of a list value; other items are kept as-is."""
+    return [v.translate(WS_TABLE).strip() if isinstance(v, str) else v for v in values]
@@ -0,0 +1,49 @@
+"""
+Token-budget truncation shared by the detectors.
+
+Each detector passes its own tokenizer (or None when tiktoken is not installed)
+and token limit; nothing here imports tiktoken itself.
+"""
+from typing import Any, Optional
+
+MAX_CHARS_PER_TOKEN = 8  # Generous bound for cleaned text; only this much is handed to the tokenizer
+
+
+def _approx_token_cut(text: str, max_tokens: int) -> int:
+    """Index where roughly max_tokens tokens end: ~4 ASCII characters or 1 other character per token."""
+    budget = max_tokens * 4  # In quarter tokens
+    for i, ch in enumerate(text):
+        budget -= 1 if ch < '\x80' else 4
+        if budget < 0:
+            return i
+    return len(text)
+
+
+def truncate_to_tokens(text: str, max_tokens: int, encoder: Optional[Any] = None, suffix: str = "") -> str:
+    """
+    Cap text at max_tokens tokens of encoder (estimated per character when encoder is None).
+
+    Args:
+        text: Cleaned prompt text
+        max_tokens: Token budget
+        encoder: tiktoken encoding, or None to estimate
+        suffix: Appended only when text was cut (e.g. "...")
+    """
+    # Byte-level BPE never yields more tokens than UTF-8 bytes: short text needs no tokenizer.
+    # Bytes are between 1x and 4x the code points, so only the middle band needs encoding
+    n = len(text)
+    if n <= max_tokens // 4 or (
+        n <= max_tokens and (text.isascii() or len(text.encode("utf-8")) <= max_tokens)
+    ):
+        return text
+
+    if encoder is None:
+        cut = _approx_token_cut(text, max_tokens)
+        return text if cut >= n else text[:cut] + suffix
+
+    # Only the head can survive truncation; don't tokenize a long description in full
+    head = text[:max_tokens * MAX_CHARS_PER_TOKEN]
+    tokens = encoder.encode(head)
+    if len(tokens) > max_tokens:
+        return encoder.decode(tokens[:max_tokens], errors="ignore") + suffix
+    return text if len(head) == n else head + suffix
@@ -1,13 +1,28 @@
 import re
+import copy
 import json
+import hashlib
 import os
-import traceback
+import random
+import asyncio
 import logging
-from typing import Dict, Any, Optional
-from google.cloud import aiplatform
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple
+from google.api_core.exceptions import (
+    InvalidArgument, NotFound, PermissionDenied, ResourceExhausted, ServiceUnavailable, Unauthenticated
+)
+from google.auth.exceptions import DefaultCredentialsError, RefreshError
+from prometheus_client import Counter
 from vertexai.generative_models import GenerativeModel, GenerationConfig
 import vertexai
 
+from utils._sanitize import normalize_whitespace, normalize_list
+from utils._truncate import truncate_to_tokens
+
 # Import HS Code Lookup for validation
 try:
     from utils.hscode_lookup import hscode_lookup
@@ -16,9 +31,133 @@ except ImportError:
     HSCODE_LOOKUP_AVAILABLE = False
     hscode_lookup = None
 
+# Optional tokenizer for token-aware truncation (falls back to character count).
+# cl100k is not Gemini's tokenizer, but it tracks CJK vs. ASCII cost far better than len().
+try:
+    import tiktoken
+    _TOKEN_ENCODER = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _TOKEN_ENCODER = None
+
+# Optional faster JSON decoding for model responses (orjson.JSONDecodeError subclasses json's)
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
 # Constants
-MODEL_NAME = "gemini-2.0-flash-exp" 
-MAX_TEXT_LENGTH = 1500
+MODEL_NAME = "gemini-2.0-flash-exp"
+MAX_TEXT_TOKENS = 1000
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "32"))  # Max in-flight Vertex AI calls per detector
+MAX_RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.5  # Seconds; doubled on every retry
+CLEAN_OFFLOAD_THRESHOLD = 4096  # Characters; longer inputs are cleaned on a worker thread
+BATCH_MAX_ITEMS = 30  # Products packed into one Vertex AI call
+BATCH_MAX_CHARS = 6000  # Serialized input budget per batched call
+RESPONSE_CACHE_SIZE = 10_000  # Successful results kept per detector, keyed on cleaned text
+RESPONSE_CACHE_TTL = float(os.getenv("GEMINI_RESPONSE_CACHE_TTL", "300"))  # Seconds; 0 disables the cache
+REFERENCE_EXAMPLES_K = 5  # Japan Post examples retrieved per product
+BATCH_MAX_EXAMPLES = 20  # Retrieved examples per batched call, shared by its items
+HEURISTIC_PREFILTER_ENABLED = os.getenv("GEMINI_HEURISTIC_PREFILTER", "true").lower() == "true"
+PREFILTER_CONFIDENCE = 0.9
+
+# Metrics
+GEMINI_CALLS = Counter('gemini_calls_total', 'Vertex AI generate_content attempts', ['outcome'])
+PREFILTER_RESULTS = Counter('gemini_prefilter_total', 'Heuristic pre-filter outcomes (hit = Vertex AI skipped)', ['outcome'])
+
+# Precompiled patterns (text cleaning, HS code normalization, regex fallback)
+_CLEAN_FLAGS = re.DOTALL | re.IGNORECASE
+_HTML_RE = re.compile(r'<[^>]*>', _CLEAN_FLAGS)
+_KEEP_RE = re.compile(r'[^a-zA-Z0-9\u3040-\u30ff\u4e00-\u9fff.,;:/\-\(\)\[\]（）％™\s]', _CLEAN_FLAGS)
+# _KEEP_RE as a str.translate table for pure-ASCII text (~10x faster there; on CJK text the regex wins)
+_ASCII_KEEP_TABLE = {cp: (cp if _KEEP_RE.match(chr(cp)) is None else None) for cp in range(128)}
+_NON_DIGIT_RE = re.compile(r'[^0-9]')
+
+_COUNTRY_RE = re.compile(r'((?:made\s+in|原産国|製造国)[\s:]*([A-Za-z\u3040-\u30ff\u4e00-\u9fff]+))', re.IGNORECASE)
+_SIZE_RE = re.compile(r'((?:size|サイズ)[\s:/]*([A-Za-z0-9/ cmMLXS.]+))', re.IGNORECASE)
+_MATERIAL_RE = re.compile(r'((?:material|素材|材料)[\s:]*([A-Za-z\u3040-\u30ff\u4e00-\u9fff0-9％/・]+))', re.IGNORECASE)
+
+# Target user keywords. Prefixed ones ("for kids", "向け: メンズ") share one scan, direct
+# mentions another; pattern order decides evidence/value order as before.
+_TARGET_PREFIXED = (
+    ('children', r'kids?|children|baby|infant|toddler|キッズ|子供|こども|ベビー|赤ちゃん|幼児'),
+    ('adult', r'adult|大人|おとな|成人'),
+    ('men', r'men|male|メンズ|男性|紳士'),
+    ('women', r'women|ladies|female|レディース|女性|婦人'),
+    ('senior', r'senior|elderly|シニア|高齢者|お年寄り'),
+    ('unisex', r'unisex|ユニセックス|男女兼用'),
+)
+_TARGET_DIRECT = (
+    ('children', r'キッズ|子供用|子ども用'),
+    ('baby', r'ベビー用|赤ちゃん用|乳児用'),
+    ('men', r'メンズ|男性用|紳士用'),
+    ('women', r'レディース|女性用|婦人用'),
+    ('senior', r'シニア|高齢者用'),
+)
+_TARGET_USER_TYPES = tuple(user_type for user_type, _ in _TARGET_PREFIXED + _TARGET_DIRECT)
+# Group p<i> is entry i of _TARGET_USER_TYPES
+_TARGET_PREFIXED_RE = re.compile(
+    r'(?:for|向け|対象)[\s:]*(?:' + '|'.join(f'(?P<p{i}>{pattern})' for i, (_, pattern) in enumerate(_TARGET_PREFIXED)) + ')',
+    re.IGNORECASE
+)
+_TARGET_DIRECT_RE = re.compile(
+    '|'.join(f'(?P<p{i}>{pattern})' for i, (_, pattern) in enumerate(_TARGET_DIRECT, len(_TARGET_PREFIXED))),
+    re.IGNORECASE
+)
+
+# HS Code heuristic (basic category detection - Japan Post 10-digit format)
+_HSCODE_PATTERNS = tuple((re.compile(pattern, re.IGNORECASE), code, evidence) for pattern, code, evidence in (
+    (r'(laptop|ノートパソコン|ノートPC)', '8471300000', 'Laptop computer'),
+    (r'(earring|イヤリング|ピアス)', '7117900000', 'Earring/jewelry'),
+    (r'(eyeshadow|アイシャドウ)', '3304200000', 'Eyeshadow cosmetic'),
+    (r'(dress|ワンピース|ドレス)', '6204421090', 'Dress for women'),
+    (r'(t-?shirt|Tシャツ)', '6109100099', 'T-shirt cotton'),
+    (r'(pants|パンツ|ズボン)', '6204631890', 'Pants for women synthetic'),
+    (r'(jacket|ジャケット|ブルゾン)', '6201931000', 'Jacket'),
+    (r'(coat|コート)', '6201121090', 'Coat'),
+    (r'(sweater|セーター|ニット)', '6110301090', 'Sweater knitted'),
+    (r'(bag|バッグ|ポーチ)', '4202290090', 'Bag/Pouch'),
+))
+
+
+# Case-sensitive twins of the IGNORECASE patterns above, for scanning text.lower(): a plain
+# scan for lowercase keywords is several times faster
+_PATTERN_SYNTAX_RE = re.compile(r'\\.|\(\?P<\w+>')
+
+def _lowercase_twin(regex: "re.Pattern[str]") -> "re.Pattern[str]":
+    """Same pattern with its literals lowercased (escapes and group names kept as written)."""
+    pattern, parts, pos = regex.pattern, [], 0
+    for m in _PATTERN_SYNTAX_RE.finditer(pattern):
+        parts.append(pattern[pos:m.start()].lower())
+        parts.append(m.group())
+        pos = m.end()
+    parts.append(pattern[pos:].lower())
+    return re.compile("".join(parts), regex.flags & ~re.IGNORECASE)
+
+_HEURISTIC_PATTERNS_CI = (_COUNTRY_RE, _SIZE_RE, _MATERIAL_RE, _TARGET_PREFIXED_RE, _TARGET_DIRECT_RE)
+_HEURISTIC_PATTERNS_LC = tuple(_lowercase_twin(p) for p in _HEURISTIC_PATTERNS_CI)
+_HSCODE_PATTERNS_LC = tuple((_lowercase_twin(p), code, evidence) for p, code, evidence in _HSCODE_PATTERNS)
+
+def _lowered_for_scan(text: str) -> Optional[str]:
+    """
+    text.lower() if the lowercase twins match it exactly where the IGNORECASE patterns match
+    text, else None: lower() can change the length ('İ'), and re also folds 'ı'/'ſ' onto i/s.
+    """
+    lowered = text.lower()
+    if len(lowered) != len(text) or 'ı' in lowered or 'ſ' in lowered:
+        return None
+    return lowered
+
+def _match_hscode_category(text: str, lowered: Optional[str] = None) -> Optional[Tuple[str, str]]:
+    """First (code, evidence) in _HSCODE_PATTERNS whose keyword appears in text."""
+    if lowered is None:
+        lowered = _lowered_for_scan(text)
+    haystack, patterns = (text, _HSCODE_PATTERNS) if lowered is None else (lowered, _HSCODE_PATTERNS_LC)
+    for pattern, code, evidence in patterns:
+        if pattern.search(haystack):
+            return code, evidence
+    return None
 
 # HS Code Reference Examples from Japan Post (10-digit format)
 # Source: https://www.post.japanpost.jp/int/use/publication/contentslist/index.php
@@ -73,7 +212,7 @@ HS_CODE_EXAMPLES = """
 """
 
 # Updated System Prompt with HS Code Detection (Japan Post 10-digit format)
-SYSTEM_PROMPT = f"""
+SYSTEM_PROMPT = """
 あなたは商品説明の属性検出とHSコード分類の専門家です。
 
 【タスク】
@@ -103,9 +242,11 @@ SYSTEM_PROMPT = f"""
    - 上記で抽出した title, description, material, size, target_user を総合的に判断
    - **必ず10桁のHSコードを返却** (例: "6204631890", "6109100099")
    - 日本郵便の公式HSコード表に基づいて判定
+   - 入力に【HSコード参考例】（日本郵便公式データ）がある場合は参考にする
    - 判定できない場合: value を "", evidence を "" (空文字)
+"""
 
-{HS_CODE_EXAMPLES}
+_SYSTEM_PROMPT_OUTPUT = f"""
 
 【出力スキーマ (JSON)】
 {{
@@ -123,8 +264,51 @@ SYSTEM_PROMPT = f"""
 - HSコードは必ず10桁で返却してください（日本郵便形式）
 - confidence は 0.0 〜 1.0 の範囲で判定の確信度を記載
 - 見つからない場合は、value と evidence を空にしてください（説明文は不要）
+
+【複数商品の入力】
+- 入力が商品の配列 [{{"i": 0, "title": "...", "desc": "..."}}, ...] の場合は、各商品を個別に判定してください
+- 出力は {{"results": [{{"i": 0, "attributes": {{...}}}}, ...]}} とし、入力と同じ順序・同じ件数で返却してください
 """
 
+# With the lookup table loaded, examples relevant to each product are retrieved per call
+# (see _reference_examples) and the static list stays out of the system prompt.
+_SYSTEM_PROMPT_STATIC = SYSTEM_PROMPT + HS_CODE_EXAMPLES + _SYSTEM_PROMPT_OUTPUT
+SYSTEM_PROMPT += _SYSTEM_PROMPT_OUTPUT
+
+def _retrieval_enabled() -> bool:
+    """Whether per-call examples are available; never waits for the lookup table to load."""
+    return bool(HSCODE_LOOKUP_AVAILABLE and hscode_lookup and hscode_lookup.is_loaded and hscode_lookup.total_items)
+
+def _system_prompt() -> str:
+    """System prompt for a new model: the static example list is only included while retrieval is unavailable."""
+    return SYSTEM_PROMPT if _retrieval_enabled() else _SYSTEM_PROMPT_STATIC
+
+# Fixed lead-in of every user message; only the product text after it varies
+_PROMPT_PREFIX = "この商品情報を分析し、属性とHSコードを判定してください。\n\n"
+_BATCH_PROMPT_PREFIX = "以下の商品配列を分析し、各商品の属性とHSコードを判定してください。\n\n"
+
+def _reference_examples(texts: List[str], limit: int = REFERENCE_EXAMPLES_K) -> str:
+    """
+    Japan Post items matching the given product texts, as a prompt block ("" if none).
+    Only for models on the retrieval prompt (see GeminiDetector._examples).
+    
+    Args:
+        texts: Product titles (one per product in the call)
+        limit: Maximum examples in the block, split evenly across texts
+    """
+    per_text = min(REFERENCE_EXAMPLES_K, max(1, limit // max(1, len(texts))))
+    seen = set()
+    lines = []
+    for text in texts:
+        for item in hscode_lookup.top_k_examples(text, k=per_text):
+            if item.hscode not in seen and len(lines) < limit:
+                seen.add(item.hscode)
+                lines.append(f"- {item.japanese} {item.english} → {item.hscode}")
+    
+    if not lines:
+        return ""
+    return "【HSコード参考例】\n" + "\n".join(lines) + "\n\n"
+
 DEFAULT_ATTRIBUTES = {
     "country": {"value": [], "evidence": "", "confidence": 0.0},
     "size": {"value": "", "evidence": "", "confidence": 0.0},
@@ -133,10 +317,112 @@ DEFAULT_ATTRIBUTES = {
     "hscode": {"value": "", "evidence": "", "confidence": 0.0}
 }
 
+@dataclass(slots=True)
+class AttrValue:
+    """A single detected attribute. Converted to a plain dict only at the API boundary."""
+    value: Any = ""
+    evidence: str = ""
+    confidence: float = 0.0
+    extra: Dict[str, Any] = field(default_factory=dict)  # e.g. hscode 'validated' / 'suggestions'
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "AttrValue":
+        extra = dict(data)
+        return cls(
+            value=extra.pop("value", ""),
+            evidence=extra.pop("evidence", ""),
+            confidence=extra.pop("confidence", 0.0),
+            extra=extra
+        )
+
+    def to_dict(self) -> Dict[str, Any]:
+        result = {"value": self.value, "evidence": self.evidence, "confidence": self.confidence}
+        result.update(self.extra)
+        return result
+
+def _default_attrs() -> Dict[str, AttrValue]:
+    """Fresh attribute objects matching DEFAULT_ATTRIBUTES (built literally; this runs on every result)."""
+    return {
+        "country": AttrValue([], "", 0.0),
+        "size": AttrValue("", "", 0.0),
+        "material": AttrValue("", "", 0.0),
+        "target_user": AttrValue([], "", 0.0),
+        "hscode": AttrValue("", "", 0.0),
+    }
+
+def _default_attrs_dict() -> Dict[str, Any]:
+    """Fresh DEFAULT_ATTRIBUTES in the public JSON shape, without going through AttrValue."""
+    return {
+        "country": {"value": [], "evidence": "", "confidence": 0.0},
+        "size": {"value": "", "evidence": "", "confidence": 0.0},
+        "material": {"value": "", "evidence": "", "confidence": 0.0},
+        "target_user": {"value": [], "evidence": "", "confidence": 0.0},
+        "hscode": {"value": "", "evidence": "", "confidence": 0.0}
+    }
+
+def _attrs_to_dict(attributes: Dict[str, Any]) -> Dict[str, Any]:
+    """Serialize attributes to the public JSON shape."""
+    return {
+        name: attr.to_dict() if isinstance(attr, AttrValue) else attr
+        for name, attr in attributes.items()
+    }
+
+def _truncate_text(text: str) -> str:
+    """Cap prompt text at MAX_TEXT_TOKENS tokens, marking a cut with "..."."""
+    return truncate_to_tokens(text, MAX_TEXT_TOKENS, _TOKEN_ENCODER, suffix="...")
+
+# One detector per model name, shared by every request in the process (see GeminiDetector.get).
+# Bounded LRU: callers validate model names, this only caps the damage if one slips through
+MAX_DETECTORS = 8
+_INSTANCE_CACHE: "OrderedDict[str, GeminiDetector]" = OrderedDict()
+_INSTANCE_LOCK = threading.Lock()
+
+@lru_cache(maxsize=None)
+def _init_vertexai(project_id: str, location: str) -> None:
+    """Configure the Vertex AI SDK once per project/location; it is process-global state."""
+    vertexai.init(project=project_id, location=location, api_transport="grpc")
+
+
+@lru_cache(maxsize=2 * MAX_DETECTORS)
+def _get_model(model_name: str, system_prompt: str) -> GenerativeModel:
+    """Build (once per model name and prompt variant) the GenerativeModel bound to the shared gRPC channel."""
+    return GenerativeModel(
+        model_name=model_name,
+        system_instruction=system_prompt
+    )
+
+
 class GeminiDetector:
+    @classmethod
+    def get(cls, model_name: Optional[str] = None) -> "GeminiDetector":
+        """
+        Return the shared detector for a model, creating it on first use.
+        
+        Callers must use this instead of instantiating GeminiDetector directly so
+        that the Vertex AI channel (and its TLS session) is reused across requests.
+        
+        Args:
+            model_name: Optional model name (defaults to MODEL_NAME)
+        
+        Raises:
+            ValueError: If the detector cannot be initialized
+        """
+        key = model_name or MODEL_NAME
+        with _INSTANCE_LOCK:
+            detector = _INSTANCE_CACHE.get(key)
+            if detector is None:
+                detector = cls(model_name=key)
+                _INSTANCE_CACHE[key] = detector
+                if len(_INSTANCE_CACHE) > MAX_DETECTORS:
+                    _INSTANCE_CACHE.popitem(last=False)
+            else:
+                _INSTANCE_CACHE.move_to_end(key)
+        return detector
+
     def __init__(self, model_name: Optional[str] = None):
         """
         Initialize Gemini Detector with Vertex AI using service account authentication.
+        Prefer GeminiDetector.get() which returns a shared instance per model.
         
         Args:
             model_name: Optional model name (defaults to MODEL_NAME)
@@ -145,6 +431,15 @@ class GeminiDetector:
             ValueError: If GOOGLE_APPLICATION_CREDENTIALS or GOOGLE_CLOUD_PROJECT is not set
         """
         self.model_name = model_name or MODEL_NAME
+        # Static examples only until the lookup table has loaded; _examples switches over after that
+        self._system_prompt = _system_prompt()
+        self._sem = asyncio.Semaphore(GEMINI_CONCURRENCY)
+        self._exact_cache: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # Same settings for every call; built once
+        self._gen_config = GenerationConfig(
+            temperature=0.0,
+            response_mime_type="application/json"
+        )
         
         # Check if service account credentials are available
         service_account_path = os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
@@ -165,37 +460,97 @@ class GeminiDetector:
         
         # Initialize Vertex AI with service account
         try:
-            vertexai.init(project=project_id, location=location)
-            self.model = GenerativeModel(
-                model_name=self.model_name,
-                system_instruction=SYSTEM_PROMPT
-            )
+            _init_vertexai(project_id, location)
+            self.model = _get_model(self.model_name, self._system_prompt)
             logging.info(f"✓ Using Vertex AI with Service Account: {self.model_name} (Project: {project_id}, Location: {location})")
         except Exception as e:
             logging.error(f"Failed to initialize Vertex AI with service account: {e}")
             raise ValueError(f"Vertex AI initialization failed: {e}")
+        
+        # Warm the channel if constructed on a running loop; otherwise the owner calls warmup()
+        try:
+            self._warmup_task = asyncio.get_running_loop().create_task(self.warmup())
+        except RuntimeError:
+            self._warmup_task = None
+
+    async def warmup(self) -> None:
+        """
+        Open the Vertex AI channel (TLS + HTTP/2 handshake) before the first real request.
+        Run it on the event loop that serves detect_product: async gRPC channels are bound to it.
+        """
+        try:
+            await self.model.count_tokens_async("warmup")
+            logging.info(f"Vertex AI channel warmed up: {self.model_name}")
+        except Exception as e:
+            logging.warning(f"Vertex AI warmup failed, first request will connect instead: {e}")
+
+    def _examples(self, texts: List[str], limit: int = REFERENCE_EXAMPLES_K) -> str:
+        """
+        Retrieved examples for one call, or "" while the model's prompt carries the static list.
+        The first call after the lookup table finishes loading moves this detector to the
+        retrieval prompt, so one built at startup does not keep the full list for good.
+        """
+        if self._system_prompt is _SYSTEM_PROMPT_STATIC:
+            if not _retrieval_enabled():
+                return ""
+            self._system_prompt = SYSTEM_PROMPT
+            self.model = _get_model(self.model_name, SYSTEM_PROMPT)
+            logging.info(f"HS code table loaded, {self.model_name} now retrieves examples per call")
+        return _reference_examples(texts, limit)
 
     def _clean_text(self, text: str) -> str:
         """Remove HTML tags and irrelevant characters to save tokens."""
         if not text:
             return ""
         
-        patterns = [
-            (r'<[^>]*>', ''),  # Remove all HTML tags
-            (r'[^a-zA-Z0-9\u3040-\u30ff\u4e00-\u9fff.,;:/\-\(\)\[\]（）％™\s]', ''), # Keep allowed chars
-            (r'\s+', ' ') # Normalize whitespace
-        ]
+        # Each pass is skipped when a C-level check shows it would be a no-op
+        cleaned = _HTML_RE.sub('', text) if '<' in text else text  # Remove all HTML tags
+        # Keep allowed chars
+        if cleaned.isascii():
+            cleaned = cleaned.translate(_ASCII_KEEP_TABLE)
+        else:
+            cleaned = _KEEP_RE.sub('', cleaned)
+        # Normalize whitespace: every \s except ' ' is non-printable, so this only skips no-op runs.
+        # split()/join collapse runs and trim the ends in C (same whitespace set as \s)
+        if '  ' in cleaned or not cleaned.isprintable():
+            return ' '.join(cleaned.split())
         
-        cleaned = text
-        for pattern, replacement in patterns:
-            cleaned = re.sub(pattern, replacement, cleaned, flags=re.DOTALL | re.IGNORECASE)
-            
         return cleaned.strip()
 
+    async def _clean_text_async(self, text: str) -> str:
+        """Clean long inputs on a worker thread so other coroutines' I/O keeps flowing meanwhile."""
+        if len(text) > CLEAN_OFFLOAD_THRESHOLD:
+            return await asyncio.to_thread(self._clean_text, text)
+        return self._clean_text(text)
+
+    @staticmethod
+    def _response_cache_key(cleaned_title: str, cleaned_desc: str) -> bytes:
+        return hashlib.sha1((cleaned_title + "\x1f" + cleaned_desc).encode("utf-8")).digest()
+
+    def _cache_get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        """Return a copy of a live cached result and mark it most recently used."""
+        entry = self._exact_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, cached = entry
+        if expires_at <= time.monotonic():
+            del self._exact_cache[key]
+            return None
+        self._exact_cache.move_to_end(key)
+        return copy.deepcopy(cached)
+
+    def _cache_put(self, key: bytes, result: Dict[str, Any]) -> None:
+        """Remember a successful result for RESPONSE_CACHE_TTL, evicting the least recently used one when full."""
+        if "error" in result or RESPONSE_CACHE_TTL <= 0:
+            return
+        self._exact_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, copy.deepcopy(result))
+        self._exact_cache.move_to_end(key)
+        if len(self._exact_cache) > RESPONSE_CACHE_SIZE:
+            self._exact_cache.popitem(last=False)
+
     def _get_default_result(self, error: str = None, code: str = None) -> Dict[str, Any]:
         """Return a standardized fallback result."""
-        import copy
-        result = {"attributes": copy.deepcopy(DEFAULT_ATTRIBUTES)}
+        result = {"attributes": _default_attrs_dict()}
         if error:
             result["error"] = error
             result["error_code"] = code
@@ -217,48 +572,209 @@ class GeminiDetector:
             return self._get_default_result("Both title and description are empty", "VALIDATION_ERROR")
         
         # Clean and combine text
-        cleaned_title = self._clean_text(title or "")
-        cleaned_desc = self._clean_text(description or "")
+        cleaned_title = await self._clean_text_async(title or "")
+        cleaned_desc = await self._clean_text_async(description or "")
         
         if not cleaned_title and not cleaned_desc:
             return self._get_default_result("No valid text after cleaning", "VALIDATION_ERROR")
         
+        # Identical listings skip the model call entirely
+        cache_key = self._response_cache_key(cleaned_title, cleaned_desc)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        pre = self._prefilter(title or "", description or "")
+        if pre is not None:
+            return pre
+        
         try:
             # Truncate if needed
-            combined_text = f"タイトル: {cleaned_title}\n説明: {cleaned_desc}"
-            if len(combined_text) > MAX_TEXT_LENGTH:
-                combined_text = combined_text[:MAX_TEXT_LENGTH] + "..."
+            combined_text = _truncate_text(f"タイトル: {cleaned_title}\n説明: {cleaned_desc}")
             
             # Vertex AI Async Call
-            generation_config = GenerationConfig(
-                temperature=0.0,
-                response_mime_type="application/json"
-            )
-            
-            response = await self.model.generate_content_async(
-                f"この商品情報を分析し、属性とHSコードを判定してください。\n\n{combined_text}",
-                generation_config=generation_config
-            )
+            examples = self._examples([cleaned_title or cleaned_desc])
+            response = await self._generate(_PROMPT_PREFIX + examples + combined_text)
             
             raw_content = response.text.strip()
-            return self._parse_json_response(raw_content)
+            result = self._parse_json_response(raw_content)
+            self._cache_put(cache_key, result)
+            return result
 
         except Exception as e:
-            error_str = str(e).lower()
+            return self._error_result(e, title or "", description or "")
+
+    def _error_result(self, e: Exception, title: str, description: str) -> Dict[str, Any]:
+        """Map a failed Vertex AI call to an error result by exception type, or to the regex fallback for unknown errors."""
+        if isinstance(e, ResourceExhausted):
+            return self._get_default_result("Vertex AI quota exceeded. Please try again later.", "QUOTA_ERROR")
+        if isinstance(e, (PermissionDenied, Unauthenticated, DefaultCredentialsError, RefreshError)):
+            return self._get_default_result("Invalid credentials or insufficient permissions.", "AUTH_ERROR")
+        if isinstance(e, NotFound):
+            return self._get_default_result(f"Model '{self.model_name}' not found or not available.", "MODEL_ERROR")
+        if isinstance(e, InvalidArgument):
+            return self._get_default_result("Invalid API configuration. Please check your settings.", "CONFIG_ERROR")
+        
+        logging.error(f"Vertex AI Error: {e}", exc_info=True)
+        # Fallback to regex if AI fails completely
+        return self._heuristic_fallback(title, description)
+
+    async def detect_many(self, items: List[Tuple[str, str]], concurrency: int = 16) -> List[Dict[str, Any]]:
+        """
+        Run detect_product for many items concurrently instead of awaiting them in a loop.
+        Each item still gets its own call; use detect_products_batch to pack items into
+        shared calls.
+
+        Args:
+            items: (title, description) pairs
+            concurrency: Max items in flight for this call (GEMINI_CONCURRENCY still caps the detector)
+
+        Returns:
+            One result per item, in input order
+        """
+        sem = asyncio.Semaphore(concurrency)
+
+        async def _one(title: str, description: str) -> Dict[str, Any]:
+            async with sem:
+                return await self.detect_product(title=title, description=description)
+
+        return await asyncio.gather(*[_one(title, description) for title, description in items])
+
+    async def detect_products_batch(self, items: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Detect attributes for many products, packing up to BATCH_MAX_ITEMS of them
+        (and BATCH_MAX_CHARS of input) into each Vertex AI call.
+        
+        Args:
+            items: (title, description) pairs
             
-            # Handle specific Vertex AI errors
-            if "quota" in error_str or "resource exhausted" in error_str:
-                return self._get_default_result("Vertex AI quota exceeded. Please try again later.", "QUOTA_ERROR")
-            elif "permission" in error_str or "unauthorized" in error_str or "unauthenticated" in error_str:
-                return self._get_default_result("Invalid credentials or insufficient permissions.", "AUTH_ERROR")
-            elif "not found" in error_str:
-                return self._get_default_result(f"Model '{self.model_name}' not found or not available.", "MODEL_ERROR")
-            elif "invalid" in error_str and "api" in error_str:
-                return self._get_default_result("Invalid API configuration. Please check your settings.", "CONFIG_ERROR")
-            else:
-                logging.error(f"Vertex AI Error: {e}", exc_info=True)
-                # Fallback to regex if AI fails completely
-                return self._heuristic_fallback(title or "", description or "")
+        Returns:
+            One result per item, in input order (same shape as detect_product)
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(items)
+        cache_keys: Dict[int, bytes] = {}
+        chunks: List[List[Dict[str, Any]]] = []
+        chunk: List[Dict[str, Any]] = []
+        chunk_chars = 0
+        
+        for i, (title, description) in enumerate(items):
+            if not title and not description:
+                results[i] = self._get_default_result("Both title and description are empty", "VALIDATION_ERROR")
+                continue
+            
+            cleaned_title = await self._clean_text_async(title or "")
+            cleaned_desc = await self._clean_text_async(description or "")
+            if not cleaned_title and not cleaned_desc:
+                results[i] = self._get_default_result("No valid text after cleaning", "VALIDATION_ERROR")
+                continue
+            
+            cache_keys[i] = self._response_cache_key(cleaned_title, cleaned_desc)
+            cached = self._cache_get(cache_keys[i])
+            if cached is not None:
+                results[i] = cached
+                continue
+            
+            pre = self._prefilter(title or "", description or "")
+            if pre is not None:
+                results[i] = pre
+                continue
+            
+            entry = {"i": i, "title": _truncate_text(cleaned_title), "desc": _truncate_text(cleaned_desc)}
+            size = len(entry["title"]) + len(entry["desc"])
+            if chunk and (len(chunk) >= BATCH_MAX_ITEMS or chunk_chars + size > BATCH_MAX_CHARS):
+                chunks.append(chunk)
+                chunk, chunk_chars = [], 0
+            chunk.append(entry)
+            chunk_chars += size
+        if chunk:
+            chunks.append(chunk)
+        
+        outputs = await asyncio.gather(*[self._detect_chunk(c, items, cache_keys) for c in chunks])
+        for c, chunk_results in zip(chunks, outputs):
+            for entry, result in zip(c, chunk_results):
+                results[entry["i"]] = result
+        return results
+
+    async def _detect_chunk(
+        self, chunk: List[Dict[str, Any]], items: List[Tuple[str, str]], cache_keys: Dict[int, bytes]
+    ) -> List[Dict[str, Any]]:
+        """
+        Run one batched call. Replies are matched to inputs by their echoed "i";
+        items missing from (or duplicated in) the reply are retried individually.
+        Only answers parsed from the model are cached here: the regex fallback used after
+        a failed call has no "error" key, and the single-item path caches in detect_product.
+        """
+        if len(chunk) == 1:
+            title, description = items[chunk[0]["i"]]
+            return [await self.detect_product(title=title, description=description)]
+        
+        try:
+            payload = json.dumps(chunk, ensure_ascii=False)
+            examples = self._examples([entry["title"] or entry["desc"] for entry in chunk], limit=BATCH_MAX_EXAMPLES)
+            response = await self._generate(_BATCH_PROMPT_PREFIX + examples + payload)
+        except Exception as e:
+            return [self._error_result(e, *items[entry["i"]]) for entry in chunk]
+        
+        try:
+            parsed = _loads(response.text.strip())
+            entries = parsed.get("results") if isinstance(parsed, dict) else None
+        except json.JSONDecodeError as e:
+            logging.warning(f"Batch JSON decode failed: {e}")
+            entries = None
+        
+        by_id: Dict[int, Dict[str, Any]] = {}
+        duplicated = set()
+        for r in entries if isinstance(entries, list) else ():
+            if isinstance(r, dict) and type(r.get("i")) is int:
+                if r["i"] in by_id:
+                    duplicated.add(r["i"])
+                by_id[r["i"]] = r
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(chunk)
+        for k, entry in enumerate(chunk):
+            i = entry["i"]
+            if i not in by_id or i in duplicated:
+                continue
+            # One malformed item (e.g. "attributes" not an object) must not fail the whole batch
+            try:
+                results[k] = self._normalize_result(by_id[i])
+            except Exception as e:
+                results[k] = self._error_result(e, *items[i])
+                continue
+            self._cache_put(cache_keys[i], results[k])
+        missing = [k for k, r in enumerate(results) if r is None]
+        if missing:
+            logging.warning(f"Batch reply matched {len(chunk) - len(missing)}/{len(chunk)} inputs, retrying the rest individually")
+            retried = await asyncio.gather(*[
+                self.detect_product(title=items[chunk[k]["i"]][0], description=items[chunk[k]["i"]][1]) for k in missing
+            ])
+            for k, r in zip(missing, retried):
+                results[k] = r
+        return results
+
+    async def _generate(self, contents: str):
+        """
+        Call Vertex AI within the concurrency limit.
+        Quota and availability errors are retried with exponential backoff + jitter;
+        the last error is re-raised so detect_product can classify it.
+        """
+        async with self._sem:
+            for attempt in range(MAX_RETRY_ATTEMPTS):
+                try:
+                    response = await self.model.generate_content_async(
+                        contents,
+                        generation_config=self._gen_config
+                    )
+                    GEMINI_CALLS.labels('success').inc()
+                    return response
+                except (ResourceExhausted, ServiceUnavailable) as e:
+                    if attempt == MAX_RETRY_ATTEMPTS - 1:
+                        GEMINI_CALLS.labels('error').inc()
+                        raise
+                    GEMINI_CALLS.labels('retry').inc()
+                    delay = 2 ** attempt * RETRY_BASE_DELAY + random.random() * 0.25
+                    logging.warning(f"Vertex AI busy ({type(e).__name__}), retry {attempt + 1}/{MAX_RETRY_ATTEMPTS - 1} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
 
     # Keep old method name for backward compatibility
     async def detect_country(self, text: str) -> Dict[str, Any]:
@@ -273,41 +789,33 @@ class GeminiDetector:
         Clean newlines, extra whitespace, and special characters from attribute values.
         Ensures clean JSON responses without formatting artifacts.
         """
-        sanitized = {}
-        
-        for attr_name, attr_data in attributes.items():
-            if not isinstance(attr_data, dict):
-                sanitized[attr_name] = attr_data
+        for attr in attributes.values():
+            if not isinstance(attr, AttrValue):
                 continue
             
-            sanitized_data = {}
-            for key, value in attr_data.items():
-                if key in ['value', 'evidence'] and isinstance(value, str):
-                    # Remove newlines and normalize whitespace
-                    cleaned = value.replace('\n', ' ').replace('\r', ' ')
-                    cleaned = re.sub(r'\s+', ' ', cleaned).strip()
-                    sanitized_data[key] = cleaned
-                elif key == 'value' and isinstance(value, list):
-                    # Clean list values
-                    sanitized_data[key] = [
-                        v.replace('\n', ' ').replace('\r', ' ').strip() 
-                        if isinstance(v, str) else v 
-                        for v in value
-                    ]
-                else:
-                    sanitized_data[key] = value
+            if isinstance(attr.value, str):
+                # Remove newlines and normalize whitespace
+                attr.value = normalize_whitespace(attr.value)
+            elif isinstance(attr.value, list):
+                # Clean list values
+                attr.value = normalize_list(attr.value)
             
-            sanitized[attr_name] = sanitized_data
+            if isinstance(attr.evidence, str):
+                attr.evidence = normalize_whitespace(attr.evidence)
         
-        return sanitized
+        return attributes
 
     def _validate_hscode(self, hscode_value: str) -> str:
         """Validate and normalize HS Code to 10 digits (Japan Post format)."""
         if not hscode_value:
             return ""
         
-        # Remove non-digits
-        digits_only = re.sub(r'[^0-9]', '', str(hscode_value))
+        # Remove non-digits (models usually return bare digits already; skip the regex then)
+        hscode_value = str(hscode_value)
+        if hscode_value.isdigit() and hscode_value.isascii():
+            digits_only = hscode_value
+        else:
+            digits_only = _NON_DIGIT_RE.sub('', hscode_value)
         
         # Take first 10 digits if longer
         if len(digits_only) >= 10:
@@ -324,56 +832,98 @@ class GeminiDetector:
     def _parse_json_response(self, raw_text: str) -> Dict[str, Any]:
         """Parse JSON and ensure structure."""
         try:
-            parsed = json.loads(raw_text)
-            import copy
-            attributes = parsed.get("attributes", copy.deepcopy(DEFAULT_ATTRIBUTES))
-            
-            # Normalize country value to list if it's a string
-            country_attr = attributes.get('country', {})
-            if isinstance(country_attr.get('value'), str):
-                country_attr['value'] = [country_attr['value']] if country_attr['value'] else []
-                attributes['country'] = country_attr
-            
-            # Normalize target_user value to list if it's a string
-            target_user_attr = attributes.get('target_user', {})
-            if isinstance(target_user_attr.get('value'), str):
-                target_user_attr['value'] = [target_user_attr['value']] if target_user_attr['value'] else []
-                attributes['target_user'] = target_user_attr
-            
-            # Validate and normalize HS Code
-            hscode_attr = attributes.get('hscode', {})
-            if hscode_attr:
-                original_hscode = hscode_attr.get('value', '')
-                validated_hscode = self._validate_hscode(original_hscode)
-                hscode_attr['value'] = validated_hscode
-                
-                # Validate against Japan Post database if available
-                if HSCODE_LOOKUP_AVAILABLE and hscode_lookup and validated_hscode:
-                    validation_result = hscode_lookup.get_validated_hscode(validated_hscode)
-                    hscode_attr['validated'] = validation_result.get('is_valid', False)
-                    if validation_result.get('suggestions'):
-                        hscode_attr['suggestions'] = validation_result['suggestions'][:2]
-                
-                attributes['hscode'] = hscode_attr
-            
-            # Sanitize all attributes to remove newlines and extra whitespace
-            attributes = self._sanitize_attributes(attributes)
-                
-            return {"attributes": attributes}
+            parsed = _loads(raw_text)
         except json.JSONDecodeError as e:
             logging.warning(f"JSON decode failed: {e}")
             return self._get_default_result("Failed to parse AI response", "PARSE_ERROR")
+        return self._normalize_result(parsed)
+
+    def _normalize_result(self, parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """Turn one decoded model result into the API attribute structure."""
+        raw_attributes = parsed.get("attributes")
+        if raw_attributes is None:
+            attributes = _default_attrs()
+        else:
+            attributes = {
+                name: AttrValue.from_dict(data) if isinstance(data, dict) else data
+                for name, data in raw_attributes.items()
+            }
+        
+        # Normalize country / target_user value to list if it's a string
+        for list_attr in ('country', 'target_user'):
+            attr = attributes.get(list_attr)
+            if isinstance(attr, AttrValue) and isinstance(attr.value, str):
+                attr.value = [attr.value] if attr.value else []
+        
+        # Validate and normalize HS Code
+        hscode_attr = attributes.get('hscode')
+        if isinstance(hscode_attr, AttrValue):
+            validated_hscode = self._validate_hscode(hscode_attr.value)
+            hscode_attr.value = validated_hscode
+            
+            # Validate against Japan Post database if available
+            if HSCODE_LOOKUP_AVAILABLE and hscode_lookup and validated_hscode:
+                validation_result = hscode_lookup.get_validated_hscode(validated_hscode)
+                hscode_attr.extra['validated'] = validation_result.get('is_valid', False)
+                if validation_result.get('suggestions'):
+                    hscode_attr.extra['suggestions'] = validation_result['suggestions'][:2]
+        
+        # Sanitize all attributes to remove newlines and extra whitespace
+        attributes = self._sanitize_attributes(attributes)
+            
+        return {"attributes": _attrs_to_dict(attributes)}
+
+    def _prefilter(self, title: str, description: str) -> Optional[Dict[str, Any]]:
+        """
+        Answer from the regex heuristics alone when they are unambiguous, skipping Vertex AI.
+        
+        Requires an explicit origin (country), an HS code that exists verbatim in the
+        Japan Post table, and the same category keyword in the title itself.
+        
+        Returns:
+            Result dict, or None if the item needs the model
+        """
+        if not HEURISTIC_PREFILTER_ENABLED or not (HSCODE_LOOKUP_AVAILABLE and hscode_lookup):
+            return None
+        
+        attributes = self._heuristic_attrs(title, description)
+        country = attributes["country"]
+        hscode = attributes["hscode"]
+        title_category = _match_hscode_category(title)
+        if (not country.value or not hscode.value
+                or title_category is None or title_category[0] != hscode.value
+                or hscode_lookup.get_by_code(hscode.value) is None):
+            PREFILTER_RESULTS.labels('miss').inc()
+            return None
+        
+        PREFILTER_RESULTS.labels('hit').inc()
+        country.confidence = PREFILTER_CONFIDENCE
+        hscode.confidence = PREFILTER_CONFIDENCE
+        hscode.extra['validated'] = True
+        return {"attributes": _attrs_to_dict(attributes)}
 
     def _heuristic_fallback(self, title: str, description: str) -> Dict[str, Any]:
         """Regex-based fallback when AI fails."""
-        import copy
-        attributes = copy.deepcopy(DEFAULT_ATTRIBUTES)
+        return {"attributes": _attrs_to_dict(self._heuristic_attrs(title, description))}
+
+    def _heuristic_attrs(self, title: str, description: str) -> Dict[str, AttrValue]:
+        """Regex-based attribute extraction shared by the fallback and the pre-filter."""
+        attributes = _default_attrs()
         text = f"{title} {description}"
         
+        # Scan the lowercased text with case-sensitive twins and slice groups out of the
+        # original by position (same spans as the IGNORECASE patterns on text)
+        lowered = _lowered_for_scan(text)
+        haystack, patterns = (text, _HEURISTIC_PATTERNS_CI) if lowered is None else (lowered, _HEURISTIC_PATTERNS_LC)
+        country_re, size_re, material_re, target_prefixed_re, target_direct_re = patterns
+        
+        def group(match: "re.Match[str]", n: int = 0) -> str:
+            return text[match.start(n):match.end(n)]
+        
         # Country detection
-        country_match = re.search(r'((?:made\s+in|原産国|製造国)[\s:]*([A-Za-z\u3040-\u30ff\u4e00-\u9fff]+))', text, re.IGNORECASE)
+        country_match = country_re.search(haystack)
         if country_match:
-            c_name = country_match.group(2).upper()
+            c_name = group(country_match, 2).upper()
             code = ""
             if "JAPAN" in c_name or "日本" in c_name: code = "JP"
             elif "CHINA" in c_name or "中国" in c_name: code = "CN"
@@ -381,68 +931,41 @@ class GeminiDetector:
             elif "INDONESIA" in c_name: code = "ID"
             
             if code:
-                attributes["country"] = {"value": [code], "evidence": country_match.group(1), "confidence": 0.3}
+                attributes["country"] = AttrValue([code], group(country_match, 1), 0.3)
 
         # Size
-        size_match = re.search(r'((?:size|サイズ)[\s:/]*([A-Za-z0-9/ cmMLXS.]+))', text, re.IGNORECASE)
+        size_match = size_re.search(haystack)
         if size_match:
-            attributes["size"] = {"value": size_match.group(2).strip(), "evidence": size_match.group(1).strip(), "confidence": 0.3}
+            attributes["size"] = AttrValue(group(size_match, 2).strip(), group(size_match, 1).strip(), 0.3)
 
         # Material
-        mat_match = re.search(r'((?:material|素材|材料)[\s:]*([A-Za-z\u3040-\u30ff\u4e00-\u9fff0-9％/・]+))', text, re.IGNORECASE)
+        mat_match = material_re.search(haystack)
         if mat_match:
-             val = mat_match.group(2) if len(mat_match.groups()) > 1 else mat_match.group(1)
-             attributes["material"] = {"value": val.strip(), "evidence": mat_match.group(0).strip(), "confidence": 0.3}
+             val = group(mat_match, 2) if len(mat_match.groups()) > 1 else group(mat_match, 1)
+             attributes["material"] = AttrValue(val.strip(), group(mat_match).strip(), 0.3)
 
         # Target User - collect all matches
-        target_patterns = [
-            (r'((?:for|向け|対象)[\s:]*((?:kids?|children|baby|infant|toddler|キッズ|子供|こども|ベビー|赤ちゃん|幼児)))', 'children'),
-            (r'((?:for|向け|対象)[\s:]*((?:adult|大人|おとな|成人)))', 'adult'),
-            (r'((?:for|向け|対象)[\s:]*((?:men|male|メンズ|男性|紳士)))', 'men'),
-            (r'((?:for|向け|対象)[\s:]*((?:women|ladies|female|レディース|女性|婦人)))', 'women'),
-            (r'((?:for|向け|対象)[\s:]*((?:senior|elderly|シニア|高齢者|お年寄り)))', 'senior'),
-            (r'((?:for|向け|対象)[\s:]*((?:unisex|ユニセックス|男女兼用)))', 'unisex'),
-            # Direct mentions without prefix
-            (r'(キッズ|子供用|子ども用)', 'children'),
-            (r'(ベビー用|赤ちゃん用|乳児用)', 'baby'),
-            (r'(メンズ|男性用|紳士用)', 'men'),
-            (r'(レディース|女性用|婦人用)', 'women'),
-            (r'(シニア|高齢者用)', 'senior'),
-        ]
-        
         found_users = []
         evidence_list = []
         
-        for pattern, user_type in target_patterns:
-            target_match = re.search(pattern, text, re.IGNORECASE)
-            if target_match and user_type not in found_users:
+        # Two scans instead of one per pattern; keep each pattern's first hit, report in pattern order
+        first_hits = {}
+        for regex in (target_prefixed_re, target_direct_re):
+            for m in regex.finditer(haystack):
+                first_hits.setdefault(int(m.lastgroup[1:]), group(m))
+        
+        for idx in sorted(first_hits):
+            user_type = _TARGET_USER_TYPES[idx]
+            if user_type not in found_users:
                 found_users.append(user_type)
-                evidence_list.append(target_match.group(0).strip())
+                evidence_list.append(first_hits[idx].strip())
         
         if found_users:
-            attributes["target_user"] = {
-                "value": found_users, 
-                "evidence": " ".join(evidence_list), 
-                "confidence": 0.3
-            }
+            attributes["target_user"] = AttrValue(found_users, " ".join(evidence_list), 0.3)
+
+        # HS Code category
+        category = _match_hscode_category(text, lowered)
+        if category:
+            attributes["hscode"] = AttrValue(category[0], category[1], 0.3)
 
-        # HS Code heuristic (basic category detection - Japan Post 10-digit format)
-        hscode_patterns = [
-            (r'(laptop|ノートパソコン|ノートPC)', '8471300000', 'Laptop computer'),
-            (r'(earring|イヤリング|ピアス)', '7117900000', 'Earring/jewelry'),
-            (r'(eyeshadow|アイシャドウ)', '3304200000', 'Eyeshadow cosmetic'),
-            (r'(dress|ワンピース|ドレス)', '6204421090', 'Dress for women'),
-            (r'(t-?shirt|Tシャツ)', '6109100099', 'T-shirt cotton'),
-            (r'(pants|パンツ|ズボン)', '6204631890', 'Pants for women synthetic'),
-            (r'(jacket|ジャケット|ブルゾン)', '6201931000', 'Jacket'),
-            (r'(coat|コート)', '6201121090', 'Coat'),
-            (r'(sweater|セーター|ニット)', '6110301090', 'Sweater knitted'),
-            (r'(bag|バッグ|ポーチ)', '4202290090', 'Bag/Pouch'),
-        ]
-        
-        for pattern, code, evidence in hscode_patterns:
-            if re.search(pattern, text, re.IGNORECASE):
-                attributes["hscode"] = {"value": code, "evidence": evidence, "confidence": 0.3}
-                break
-
-        return {"attributes": attributes}
\ No newline at end of file
+        return attributes
\ No newline at end of file
@@ -10,45 +10,46 @@ logger = logging.getLogger(__name__)
 
 # Configuration
 DEFAULT_MODEL = "gemini-2.0-flash"
-VALID_MODELS = [
+VALID_MODELS = frozenset({
     "gemini-2.0-flash",
-    "gemini-2.5-flash", 
+    "gemini-2.5-flash",
     "gemini-1.5-flash",
     "gemini-1.5-pro",
     "gemini-pro"
-]
+})
+_VALID_MODELS_STR = ", ".join(sorted(VALID_MODELS))
 
 
 class GeminiDetectorService:
     """Service to handle Gemini detector requests with validation."""
     
     @staticmethod
-    def validate_model(model_name: str) -> Tuple[bool, Optional[str]]:
+    def validate_model(model_name: str) -> Tuple[bool, Optional[str], str]:
         """
-        Validate model name format.
+        Validate model name format and check it against VALID_MODELS.
         
         Args:
             model_name: The model name to validate
             
         Returns:
-            Tuple of (is_valid, error_message)
+            Tuple of (is_valid, error_message, stripped_value) so callers need not strip again
         """
         if not model_name:
-            return False, "Model name is required"
+            return False, "Model name is required", ""
         
         model_name = model_name.strip()
         
         if len(model_name) < 3:
-            return False, "Invalid model name format"
+            return False, "Invalid model name format", model_name
         
-        # Optional: Check if model is in known list (can be disabled for flexibility)
-        # if model_name not in VALID_MODELS:
-        #     return False, f"Model '{model_name}' is not supported. Valid models: {', '.join(VALID_MODELS)}"
+        # Same rule as the API endpoints: only models in the known list
+        if model_name not in VALID_MODELS:
+            return False, f"Model '{model_name}' is not supported. Valid models: {_VALID_MODELS_STR}", model_name
         
-        return True, None
+        return True, None, model_name
     
     @staticmethod
-    def validate_api_key(api_key: str) -> Tuple[bool, Optional[str]]:
+    def validate_api_key(api_key: str) -> Tuple[bool, Optional[str], str]:
         """
         Validate API key format.
         
@@ -56,20 +57,20 @@ class GeminiDetectorService:
             api_key: The API key to validate
             
         Returns:
-            Tuple of (is_valid, error_message)
+            Tuple of (is_valid, error_message, stripped_value) so callers need not strip again
         """
         if not api_key:
-            return False, "Gemini API key is required"
+            return False, "Gemini API key is required", ""
         
         api_key = api_key.strip()
         
         if len(api_key) < 20:
-            return False, "Invalid API key format"
+            return False, "Invalid API key format", api_key
         
-        return True, None
+        return True, None, api_key
     
     @staticmethod
-    def validate_description(description: str) -> Tuple[bool, Optional[str]]:
+    def validate_description(description: str) -> Tuple[bool, Optional[str], str]:
         """
         Validate product description.
         
@@ -77,12 +78,13 @@ class GeminiDetectorService:
             description: The description to validate
             
         Returns:
-            Tuple of (is_valid, error_message)
+            Tuple of (is_valid, error_message, stripped_value) so callers need not strip again
         """
-        if not description or not description.strip():
-            return False, "Description is required"
+        description = (description or "").strip()
+        if not description:
+            return False, "Description is required", ""
         
-        return True, None
+        return True, None, description
     
     @classmethod
     def validate_custom_params(
@@ -101,9 +103,11 @@ class GeminiDetectorService:
         Returns:
             Dict with 'success', and 'error_code'/'error_message' if validation fails
         """
-        # Check if user is providing custom values
-        has_custom_model = model_name is not None and model_name.strip() != ""
-        has_custom_key = api_key is not None and api_key.strip() != ""
+        # Check if user is providing custom values (strip once, reuse below)
+        model_name = (model_name or "").strip()
+        api_key = (api_key or "").strip()
+        has_custom_model = bool(model_name)
+        has_custom_key = bool(api_key)
         
         # Validation: If providing custom model, must also provide custom key
         if has_custom_model and not has_custom_key:
@@ -124,7 +128,7 @@ class GeminiDetectorService:
         # If custom params provided, validate them
         if has_custom_model and has_custom_key:
             # Validate model
-            valid_model, model_error = cls.validate_model(model_name)
+            valid_model, model_error, _ = cls.validate_model(model_name)
             if not valid_model:
                 return {
                     "success": False,
@@ -133,7 +137,7 @@ class GeminiDetectorService:
                 }
             
             # Validate API key format (not actual validity, that's checked when calling API)
-            valid_key, key_error = cls.validate_api_key(api_key)
+            valid_key, key_error, _ = cls.validate_api_key(api_key)
             if not valid_key:
                 return {
                     "success": False,
@@ -161,25 +165,30 @@ class GeminiDetectorService:
         Returns:
             Dict with 'success', 'model', 'api_key' or 'error_code', 'error_message'
         """
+        # Strip once; validate_custom_params' own strip() then returns these as-is
+        model_name = (model_name or "").strip()
+        api_key = (api_key or "").strip()
+        
         # Validate custom params
         validation_result = cls.validate_custom_params(model_name, api_key)
         if not validation_result["success"]:
             return validation_result
         
         # Determine which model and key to use
-        has_custom = model_name is not None and model_name.strip() != ""
-        
-        final_model = (model_name or DEFAULT_MODEL).strip()
-        final_key = (api_key if has_custom else fallback_api_key or "").strip()
-        
-        # Validate final API key
-        valid_key, key_error = cls.validate_api_key(final_key)
-        if not valid_key:
-            return {
-                "success": False,
-                "error_code": "CONFIG_ERROR",
-                "error_message": key_error or "Gemini API key is not configured"
-            }
+        has_custom = bool(model_name)
+        final_model = model_name or DEFAULT_MODEL
+        
+        if has_custom:
+            # Custom key format was already checked by validate_custom_params
+            final_key = api_key
+        else:
+            valid_key, key_error, final_key = cls.validate_api_key((fallback_api_key or "").strip())
+            if not valid_key:
+                return {
+                    "success": False,
+                    "error_code": "CONFIG_ERROR",
+                    "error_message": key_error or "Gemini API key is not configured"
+                }
         
         return {
             "success": True,
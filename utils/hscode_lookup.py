@@ -5,20 +5,76 @@ Provides search and validation functions for Japan Post HS Codes.
 import json
 import os
 import re
-from typing import List, Optional, Dict, Any
-from dataclasses import dataclass
+import pickle
+import threading
+from itertools import islice
+from typing import List, Optional, Dict, Any, Set, Tuple
+from dataclasses import dataclass, field
 import logging
 
+# Optional faster JSON parsing for the data file
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
 logger = logging.getLogger(__name__)
 
+# Bump when the cached structures change shape, so stale sidecar files are rebuilt
+_INDEX_CACHE_VERSION = 3
+
+_QUALIFIER_RE = re.compile(r'[（(].*$')
+_NON_DIGIT_RE = re.compile(r'[^0-9]')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+# Title wording -> qualifier used in the Japan Post names; breaks ties between variants
+# of the same item (e.g. ズボン（女性用 合成繊維） vs ズボン（男性用 綿）)
+_QUALIFIER_HINTS = tuple((re.compile(pattern), qualifier) for pattern, qualifier in (
+    (r'レディース|ウィメンズ|女性|婦人|\bwomen|\bladies', '女性用'),
+    (r'メンズ|男性|紳士|\bmen\b', '男性用'),
+    (r'綿|コットン|\bcotton', '綿'),
+    (r'ポリエステル|ナイロン|アクリル|合成|polyester|nylon|acrylic', '合成繊維'),
+    (r'ウール|羊毛|\bwool', '羊毛'),
+    (r'革|レザー|leather', '革'),
+))
+
+
+def _digits(code: str) -> str:
+    """ASCII digits of an HS code; codes that are already bare digits skip the regex."""
+    if code.isdigit() and code.isascii():
+        return code
+    return _NON_DIGIT_RE.sub('', code)
+
 
-@dataclass
+def _grams(text: str) -> Set[str]:
+    """Characters and character bigrams of text (the keys of the search index)."""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+def _words(text: str) -> str:
+    """Lowercase alphanumeric words joined by single spaces and padded, for whole-word `in` checks."""
+    return f" {' '.join(_WORD_RE.findall(text.lower()))} "
+
+
+@dataclass(slots=True)
 class HSCodeItem:
     """Represents an HS Code item from Japan Post."""
     japanese: str
     chinese: str
     english: str
     hscode: str
+    # Lowercased names, computed once for case-insensitive search
+    ja_lc: str = field(init=False, repr=False, compare=False)
+    en_lc: str = field(init=False, repr=False, compare=False)
+    cn_lc: str = field(init=False, repr=False, compare=False)
+    
+    def __post_init__(self):
+        self.ja_lc = self.japanese.lower()
+        self.en_lc = self.english.lower()
+        self.cn_lc = self.chinese.lower()
     
     def to_dict(self) -> Dict[str, str]:
         return {
@@ -33,22 +89,33 @@ class HSCodeLookup:
     """
     HS Code lookup service using Japan Post data.
     Provides search by keyword and validation functions.
-    """
+    Use the module-level `hscode_lookup` instance rather than constructing another.
     
-    _instance = None
-    _data: List[HSCodeItem] = []
-    _hscode_map: Dict[str, HSCodeItem] = {}
-    _loaded = False
+    The data file is loaded on a background thread; lookups issued before it finishes
+    block until it is ready.
+    """
     
-    def __new__(cls):
-        """Singleton pattern for efficient memory usage."""
-        if cls._instance is None:
-            cls._instance = super().__new__(cls)
-        return cls._instance
+    def __init__(self, background: bool = True):
+        self._data: Tuple[HSCodeItem, ...] = ()
+        self._hscode_map: Dict[str, HSCodeItem] = {}
+        self._example_keys: List[Tuple[str, str]] = []  # (japanese base name, english base words) per item
+        self._gram_index: Dict[str, List[int]] = {}  # Character / bigram -> item indices, ascending
+        self._prefix6: Set[str] = set()  # First 6 digits of every code
+        self._prefix4_index: Dict[str, List[HSCodeItem]] = {}  # First 4 digits -> items, in data order
+        self._loaded = False
+        self._load_lock = threading.Lock()
+        if background:
+            threading.Thread(target=self._ensure_loaded, name="hscode-load", daemon=True).start()
+        else:
+            self._ensure_loaded()
     
-    def __init__(self):
-        if not HSCodeLookup._loaded:
-            self._load_data()
+    def _ensure_loaded(self):
+        """Load the data exactly once; concurrent callers wait for the loading thread."""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self._load_data()
     
     def _load_data(self):
         """Load HS Code data from JSON file."""
@@ -63,36 +130,113 @@ class HSCodeLookup:
             abs_path = os.path.abspath(path)
             if os.path.exists(abs_path):
                 try:
-                    with open(abs_path, 'r', encoding='utf-8') as f:
-                        raw_data = json.load(f)
+                    if self._load_index_cache(abs_path):
+                        self._loaded = True
+                        logger.info(f"✓ Loaded {len(self._data)} HS Codes from {abs_path}.pkl")
+                        return
                     
-                    items = raw_data.get('items', [])
-                    HSCodeLookup._data = []
-                    HSCodeLookup._hscode_map = {}
+                    with open(abs_path, 'rb') as f:
+                        raw_data = _json_loads(f.read())
                     
-                    for item in items:
-                        hs_item = HSCodeItem(
+                    self._data = tuple([
+                        HSCodeItem(
                             japanese=item.get('ja', ''),
                             chinese=item.get('cn', ''),
                             english=item.get('en', ''),
                             hscode=item.get('hscode', '')
                         )
-                        HSCodeLookup._data.append(hs_item)
-                        HSCodeLookup._hscode_map[hs_item.hscode] = hs_item
+                        for item in raw_data.get('items', [])
+                    ])
+                    self._build_indexes()
+                    self._save_index_cache(abs_path)
                     
-                    HSCodeLookup._loaded = True
-                    logger.info(f"✓ Loaded {len(HSCodeLookup._data)} HS Codes from {abs_path}")
+                    self._loaded = True
+                    logger.info(f"✓ Loaded {len(self._data)} HS Codes from {abs_path}")
                     return
                 except Exception as e:
                     logger.error(f"Error loading HS Code data: {e}")
         
         logger.warning("HS Code data file not found. Lookup features will be limited.")
-        HSCodeLookup._loaded = True  # Mark as loaded to prevent repeated attempts
+        self._loaded = True  # Mark as loaded to prevent repeated attempts
+    
+    @staticmethod
+    def _index_cache_key(json_path: str) -> Tuple[int, int, int]:
+        stat = os.stat(json_path)
+        return (_INDEX_CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+    
+    def _load_index_cache(self, json_path: str) -> bool:
+        """
+        Restore data and indexes from the pickle next to the JSON file, if it matches the
+        file's mtime/size. Returns False (caller parses the JSON) when missing or stale.
+        """
+        try:
+            with open(json_path + '.pkl', 'rb') as f:
+                # The key is its own record, so a stale file is rejected before unpickling items
+                if pickle.load(f) != self._index_cache_key(json_path):
+                    return False
+                cached = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable HS Code index cache: {e}")
+            return False
+        
+        (self._data, self._hscode_map, self._prefix6,
+         self._prefix4_index, self._gram_index, self._example_keys) = cached
+        return True
+    
+    def _save_index_cache(self, json_path: str):
+        """Write the pickle sidecar; best effort (e.g. read-only image), atomic via rename."""
+        payload = (
+            self._data, self._hscode_map,
+            self._prefix6, self._prefix4_index, self._gram_index,
+            self._example_keys
+        )
+        tmp_path = f"{json_path}.pkl.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self._index_cache_key(json_path), f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, json_path + '.pkl')
+        except OSError as e:
+            logger.debug(f"HS Code index cache not written: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+    
+    def _build_indexes(self):
+        """Derive the lookup structures from self._data."""
+        data = self._data
+        self._hscode_map = {item.hscode: item for item in data}
+        self._prefix6 = {item.hscode[:6] for item in data}
+        
+        prefix4_index: Dict[str, List[HSCodeItem]] = {}
+        gram_index: Dict[str, List[int]] = {}
+        for idx, item in enumerate(data):
+            prefix4_index.setdefault(item.hscode[:4], []).append(item)
+            for gram in _grams(item.ja_lc) | _grams(item.en_lc) | _grams(item.cn_lc) | _grams(item.hscode):
+                gram_index.setdefault(gram, []).append(idx)
+        self._prefix4_index = prefix4_index
+        self._gram_index = gram_index
+        
+        # Base names without the "（女性用 綿）" qualifier, used by top_k_examples
+        self._example_keys = [
+            (_QUALIFIER_RE.sub('', item.ja_lc).strip(), _words(_QUALIFIER_RE.sub('', item.english)).strip())
+            for item in data
+        ]
+    
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the data has finished loading (never waits for the loading thread)."""
+        return self._loaded
     
     @property
     def total_items(self) -> int:
         """Get total number of HS Code items loaded."""
-        return len(HSCodeLookup._data)
+        if not self._loaded:
+            self._ensure_loaded()
+        return len(self._data)
     
     def search(self, keyword: str, limit: int = 10) -> List[HSCodeItem]:
         """
@@ -105,23 +249,79 @@ class HSCodeLookup:
         Returns:
             List of matching HSCodeItem objects
         """
+        if not self._loaded:
+            self._ensure_loaded()
         if not keyword:
             return []
         
         keyword_lower = keyword.lower()
-        results = []
         
-        for item in HSCodeLookup._data:
+        # Only items holding every character/bigram of the keyword can contain it;
+        # candidates are then confirmed in data order
+        candidates = self._index_candidates(keyword_lower)
+        if keyword != keyword_lower:
+            candidates |= self._index_candidates(keyword)  # hscode is matched case-sensitively
+        
+        def _matches(item: HSCodeItem) -> bool:
             # Search in all language fields
-            if (keyword_lower in item.japanese.lower() or
-                keyword_lower in item.english.lower() or
-                keyword_lower in item.chinese.lower() or
-                keyword in item.hscode):
-                results.append(item)
-                if len(results) >= limit:
-                    break
+            return (keyword_lower in item.ja_lc or
+                    keyword_lower in item.en_lc or
+                    keyword_lower in item.cn_lc or
+                    keyword in item.hscode)
+        
+        return list(islice(filter(_matches, map(self._data.__getitem__, sorted(candidates))), limit))
+    
+    def _index_candidates(self, text: str) -> Set[int]:
+        """Indices of items whose indexed text holds every character and bigram of text."""
+        postings = []
+        gram_index = self._gram_index
+        for gram in _grams(text):
+            posting = gram_index.get(gram)
+            if posting is None:
+                return set()
+            postings.append(posting)
+        
+        postings.sort(key=len)  # Intersect starting from the rarest gram
+        return set(postings[0]).intersection(*postings[1:])
+    
+    def top_k_examples(self, text: str, k: int = 5) -> List[HSCodeItem]:
+        """
+        Pick reference items for a product, to show the model as HS Code examples.
+        
+        An item matches when its base name (Japanese substring, or English whole words)
+        appears in the text; longer, more specific names rank first.
         
-        return results
+        Args:
+            text: Product title (or description)
+            k: Maximum items to return
+            
+        Returns:
+            List of matching HSCodeItem objects
+        """
+        if not self._loaded:
+            self._ensure_loaded()
+        if not text:
+            return []
+        
+        text_lower = text.lower()
+        text_words = _words(text)
+        hints = [qualifier for pattern, qualifier in _QUALIFIER_HINTS if pattern.search(text_lower)]
+        scored = []
+        data = self._data
+        
+        for idx, (ja_base, en_base) in enumerate(self._example_keys):
+            score = 0
+            if len(ja_base) >= 2 and ja_base in text_lower:
+                score = len(ja_base)
+            if len(en_base) >= 3 and f" {en_base} " in text_words:
+                score = max(score, len(en_base))
+            if score:
+                japanese = data[idx].japanese
+                bonus = sum(1 for qualifier in hints if qualifier in japanese)
+                scored.append((-score, -bonus, idx))
+        
+        scored.sort()
+        return [data[idx] for _, _, idx in scored[:k]]
     
     def validate(self, hscode: str) -> bool:
         """
@@ -133,25 +333,18 @@ class HSCodeLookup:
         Returns:
             True if valid, False otherwise
         """
+        if not self._loaded:
+            self._ensure_loaded()
         if not hscode:
             return False
         
         # Normalize: remove non-digits and pad to 10 digits
-        clean_code = re.sub(r'[^0-9]', '', hscode)
+        clean_code = _digits(hscode)
         if len(clean_code) < 6:
             return False
         
-        # Check exact match
-        if clean_code in HSCodeLookup._hscode_map:
-            return True
-        
-        # Check 6-digit prefix match
-        prefix = clean_code[:6]
-        for code in HSCodeLookup._hscode_map.keys():
-            if code.startswith(prefix):
-                return True
-        
-        return False
+        # Exact match, else 6-digit prefix match
+        return clean_code in self._hscode_map or clean_code[:6] in self._prefix6
     
     def get_by_code(self, hscode: str) -> Optional[HSCodeItem]:
         """
@@ -163,8 +356,10 @@ class HSCodeLookup:
         Returns:
             HSCodeItem if found, None otherwise
         """
-        clean_code = re.sub(r'[^0-9]', '', hscode)
-        return HSCodeLookup._hscode_map.get(clean_code)
+        if not self._loaded:
+            self._ensure_loaded()
+        clean_code = _digits(hscode)
+        return self._hscode_map.get(clean_code)
     
     def find_similar(self, hscode: str, limit: int = 5) -> List[HSCodeItem]:
         """
@@ -177,20 +372,19 @@ class HSCodeLookup:
         Returns:
             List of similar HSCodeItem objects
         """
+        if not self._loaded:
+            self._ensure_loaded()
         if not hscode or len(hscode) < 4:
             return []
         
-        clean_code = re.sub(r'[^0-9]', '', hscode)
+        clean_code = _digits(hscode)
         prefix = clean_code[:4]  # Match first 4 digits
         
-        results = []
-        for item in HSCodeLookup._data:
-            if item.hscode.startswith(prefix):
-                results.append(item)
-                if len(results) >= limit:
-                    break
+        if len(prefix) == 4:
+            return self._prefix4_index.get(prefix, [])[:limit]
         
-        return results
+        # Fewer than 4 digits after cleaning: match on what is left
+        return list(islice((item for item in self._data if item.hscode.startswith(prefix)), limit))
     
     def get_validated_hscode(self, ai_hscode: str, product_keywords: str = "") -> Dict[str, Any]:
         """
@@ -238,5 +432,5 @@ class HSCodeLookup:
         return result
 
 
-# Singleton instance for easy import
+# Shared instance; import this rather than constructing HSCodeLookup again
 hscode_lookup = HSCodeLookup()
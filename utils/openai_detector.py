@@ -1,15 +1,123 @@
 import re
+import os
+import copy
 import json
-import traceback
-from typing import Dict, Any, Optional
-from openai import AsyncOpenAI, APIError, RateLimitError, AuthenticationError
+import asyncio
+import hashlib
+import time
+import tempfile
+import logging
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
+import httpx
+from prometheus_client import Counter
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIError, RateLimitError, AuthenticationError
+
+from utils._truncate import truncate_to_tokens
+from utils.validator import country_name_to_alpha2, find_country_name
+
+logger = logging.getLogger(__name__)
+
+# Optional faster JSON for replies and cache files (orjson.JSONDecodeError subclasses json's)
+try:
+    import orjson
+    _loads = orjson.loads
+    _dumps = orjson.dumps
+except ImportError:
+    _loads = json.loads
+
+    def _dumps(obj: Any) -> bytes:
+        return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+# Optional tokenizer for token-exact truncation (falls back to a per-character estimate)
+try:
+    import tiktoken
+    _TOKEN_ENCODER = tiktoken.encoding_for_model("gpt-4o-mini")
+except Exception:
+    _TOKEN_ENCODER = None
 
 # Constants
 MODEL_NAME = "gpt-4o-mini"
-MAX_TEXT_LENGTH = 1000
+MAX_TEXT_TOKENS = 500  # Input budget per description
+MAX_OUTPUT_TOKENS = 200  # Compact reply is ~60-120 tokens; a cut-off reply falls back to the regex heuristic
+BATCH_MAX_ITEMS = 10  # Descriptions packed into one detect_country_batch request
+BATCH_MAX_CHARS = 6000  # Serialized input budget per batched request
+# Max in-flight chat completions per detector; size it to the account's RPM/TPM limits
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "20"))
+# Retries of 408/409/429/5xx, timeouts and connection errors, done by the SDK with exponential
+# backoff + jitter (honouring Retry-After); only the final failure reaches detect_country
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+# Bump whenever SYSTEM_PROMPT or RESPONSE_FORMAT changes: it is part of the response cache key
+PROMPT_VERSION = "v5"
+# Routes every request with the same static prefix (system prompt + schema) to the same
+# OpenAI prompt-cache shard; versioned so a prompt edit starts a fresh key
+PROMPT_CACHE_KEY = f"detect-country-{PROMPT_VERSION}"
+RESPONSE_CACHE_SIZE = 10_000  # Successful results kept in memory per detector
+RESPONSE_CACHE_TTL = float(os.getenv("OPENAI_RESPONSE_CACHE_TTL", "300"))  # Seconds; 0 disables the memory cache
+# Opt-in on-disk cache of successful results, one JSON file per cleaned input
+RESPONSE_CACHE_DIR = os.getenv("OPENAI_CACHE_DIR", "")
+DISK_CACHE_TTL = float(os.getenv("OPENAI_CACHE_TTL", str(7 * 86400)))  # Seconds; 0 keeps entries forever
+
+# Billed tokens by kind; cached_prompt / prompt is the prompt-cache hit ratio, and a drop
+# after a prompt edit means the static prefix stopped matching
+OPENAI_TOKENS = Counter('openai_tokens_total', 'OpenAI tokens per request', ['kind'])
+
+# One connection pool for every detector in the process, so keep-alive sockets (and their
+# TLS sessions) are reused across instances. Like the detectors, it belongs to the app's
+# single long-lived event loop: it is created with the first detector and closed at exit.
+_shared_http: Optional[httpx.AsyncClient] = None
+_shared_http_loop: Optional[asyncio.AbstractEventLoop] = None
+_shared_http_lock = threading.Lock()
+
+def _get_shared_http() -> httpx.AsyncClient:
+    """Return the shared connection pool, creating it (and its exit hook) on first use."""
+    global _shared_http, _shared_http_loop
+    with _shared_http_lock:
+        if _shared_http is None:
+            _shared_http = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=1000, max_keepalive_connections=200),
+                timeout=httpx.Timeout(30.0, connect=5.0)
+            )
+            try:
+                _shared_http_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                _shared_http_loop = None
+            atexit.register(_close_shared_http)
+        return _shared_http
+
+async def aclose_shared_http() -> None:
+    """Close the shared connection pool; await it on the app's loop during shutdown."""
+    global _shared_http
+    with _shared_http_lock:
+        client, _shared_http = _shared_http, None
+    if client is not None:
+        await client.aclose()
+
+def _close_shared_http() -> None:
+    """Exit hook: close the pool on the loop that owns it if that loop still runs, else on a fresh one."""
+    if _shared_http is None:
+        return
+    loop = _shared_http_loop
+    try:
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(aclose_shared_http(), loop).result(timeout=5)
+        else:
+            asyncio.run(aclose_shared_http())
+    except Exception as e:
+        logger.debug("Closing the shared OpenAI HTTP client failed: %s", e)
+
 SYSTEM_PROMPT = """あなたは商品説明の製造国・属性検出の専門家です。製造国や原産国に焦点を当て、配送先やブランド名から推測しないでください。
 ... (Keep your original long prompt here - shortened for brevity in this view) ...
-JSONのみ出力。"""
+JSONのみ出力。
+出力キーは短縮形: c=country（ISOコード配列）, s=size, m=material。各属性は v=value, e=evidence, cf=confidence。
+
+ユーザーメッセージは商品説明のみです（言語は問いません。翻訳せずそのまま分析してください）。この商品説明を分析し、構造化JSONを返却してください。"""
+# Built once and shared by every request (the SDK only reads it)
+_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+_BATCH_SYSTEM_MSG = {"role": "system", "content": SYSTEM_PROMPT + """
+複数商品モード: ユーザーメッセージが [{"i": 0, "t": "..."}, ...] の配列の場合、各商品を個別に判定し、{"r": [{"i": 0, "c": ..., "s": ..., "m": ...}, ...]} を返却してください。i は入力の値をそのまま返してください。"""}
 
 DEFAULT_ATTRIBUTES = {
     "country": {"value": ["ZZ"], "evidence": "none", "confidence": 0.0},
@@ -17,31 +125,168 @@ DEFAULT_ATTRIBUTES = {
     "material": {"value": "none", "evidence": "none", "confidence": 0.0}
 }
 
+def _attr_schema(value_schema: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "type": "object",
+        "properties": {"v": value_schema, "e": {"type": "string"}, "cf": {"type": "number"}},
+        "required": ["v", "e", "cf"],
+        "additionalProperties": False
+    }
+
+# Short reply keys -> public attribute names; the model writes the compact form (fewer
+# output tokens) and _parse_json_response expands it
+_COMPACT_ATTRS = (("c", "country"), ("s", "size"), ("m", "material"))
+_COMPACT_NAMES = dict(_COMPACT_ATTRS)
+
+# Structured output: the API constrains decoding to this schema, so replies are always valid JSON
+RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "product_attributes",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "c": _attr_schema({"type": "array", "items": {"type": "string"}}),
+                "s": _attr_schema({"type": "string"}),
+                "m": _attr_schema({"type": "string"})
+            },
+            "required": ["c", "s", "m"],
+            "additionalProperties": False
+        }
+    }
+}
+
+BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "product_attributes_batch",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "r": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {"i": {"type": "integer"}, **RESPONSE_FORMAT["json_schema"]["schema"]["properties"]},
+                        "required": ["i", "c", "s", "m"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["r"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Precompiled patterns (text cleaning, regex fallback)
+_CLEAN_FLAGS = re.DOTALL | re.IGNORECASE
+_HTML_RE = re.compile(r'<[^>]*>', _CLEAN_FLAGS)
+_KEEP_RE = re.compile(r'[^a-zA-Z0-9\u3040-\u30ff\u4e00-\u9fff.,;:/\-\(\)\[\]（）％™\s]', _CLEAN_FLAGS)
+# _KEEP_RE as a str.translate table for pure-ASCII text (~10x faster there; on CJK text the regex wins)
+_ASCII_KEEP_TABLE = {cp: (cp if _KEEP_RE.match(chr(cp)) is None else None) for cp in range(128)}
+_COUNTRY_RE = re.compile(r'((?:made\s+in|原産国|製造国)[\s:]*([A-Za-z\u3040-\u30ff\u4e00-\u9fff]+))', re.IGNORECASE)
+_SIZE_RE = re.compile(r'((?:size|サイズ)[\s:/]*([A-Za-z0-9/ cmMLXS.]+))', re.IGNORECASE)
+_MATERIAL_RE = re.compile(r'((?:material|素材|材料)[\s:]*([A-Za-z\u3040-\u30ff\u4e00-\u9fff0-9％/・]+))', re.IGNORECASE)
+_MATERIAL_WORD_RE = re.compile(r'(カシミヤ|cashmere|cotton|wool)', re.IGNORECASE)
+# Case-sensitive twins of the fallback patterns, run on text.lower(): a plain scan for
+# the lowercase keywords is ~2-4x faster than an IGNORECASE one
+_FALLBACK_PATTERNS_CI = (_COUNTRY_RE, _SIZE_RE, _MATERIAL_RE, _MATERIAL_WORD_RE)
+_FALLBACK_PATTERNS_LC = tuple(re.compile(p.pattern) for p in _FALLBACK_PATTERNS_CI)
+
+
+def _strip_tags(text: str) -> str:
+    """
+    Remove <...> tags (same result as _HTML_RE.sub('', text)).
+    Nothing after the last '>' can be a tag, so that tail is never handed to the regex:
+    there every unclosed '<' would otherwise rescan to the end of the text (quadratic).
+    """
+    end = text.rfind('>')
+    if end < 0 or '<' not in text:
+        return text
+    return _HTML_RE.sub('', text[:end + 1]) + text[end + 1:]
+
+
+def _truncate_text(text: str) -> str:
+    """Cap prompt text at MAX_TEXT_TOKENS tokens."""
+    return truncate_to_tokens(text, MAX_TEXT_TOKENS, _TOKEN_ENCODER)
+
+
+class _CompactAttrScanner:
+    """
+    Incremental scanner over a streamed compact reply ({"c":{...},"s":{...},"m":{...}}).
+    feed() returns each top-level member as '"c":{...}' the moment its object closes,
+    so attributes can be handed out before the rest of the reply is generated.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start = -1
+
+    def feed(self, chunk: str) -> List[str]:
+        self.buffer += chunk
+        closed = []
+        buf = self.buffer
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._member_start < 0:
+                    self._member_start = i
+            elif ch in '{[':
+                self._depth += 1
+            elif ch in '}]':
+                self._depth -= 1
+                if self._depth == 1 and self._member_start >= 0:
+                    closed.append(buf[self._member_start:i + 1])
+                    self._member_start = -1
+        self._pos = len(buf)
+        return closed
+
 class OpenAIDetector:
     def __init__(self, api_key: str):
         if not api_key:
             raise ValueError("OPENAI_API_KEY is required")
         
-        self.client = AsyncOpenAI(api_key=api_key)
+        self.client = AsyncOpenAI(api_key=api_key, http_client=_get_shared_http(), max_retries=OPENAI_MAX_RETRIES)
         self.model = MODEL_NAME
-        print(f"✓ Using OpenAI model: {self.model}")
+        self._sem = asyncio.Semaphore(OPENAI_CONCURRENCY)
+        # Cleaned text -> running detection; identical concurrent inputs share one API call
+        self._inflight: Dict[str, "asyncio.Task[Dict[str, Any]]"] = {}
+        # Response cache key -> (expires_at, result), least recently used first
+        self._exact_cache: "OrderedDict[bytes, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        logger.info("✓ Using OpenAI model: %s", self.model)
     
     def _clean_text(self, text: str) -> str:
         """Remove HTML tags and irrelevant characters to save tokens."""
         if not text:
             return ""
         
-        # Consolidated regex patterns
-        patterns = [
-            (r'<[^>]*>', ''),  # Remove all HTML tags
-            (r'[^a-zA-Z0-9\u3040-\u30ff\u4e00-\u9fff.,;:/\-\(\)\[\]（）％™\s]', ''), # Keep allowed chars
-            (r'\s+', ' ') # Normalize whitespace
-        ]
-        
-        cleaned = text
-        for pattern, replacement in patterns:
-            cleaned = re.sub(pattern, replacement, cleaned, flags=re.DOTALL | re.IGNORECASE)
-            
+        # Each pass is skipped when a C-level check shows it would be a no-op
+        cleaned = _strip_tags(text)  # Remove all HTML tags
+        # Keep allowed chars
+        if cleaned.isascii():
+            cleaned = cleaned.translate(_ASCII_KEEP_TABLE)
+        else:
+            cleaned = _KEEP_RE.sub('', cleaned)
+        # Normalize whitespace: every \s except ' ' is non-printable, so this only skips no-op runs.
+        # split()/join collapse runs and trim the ends in C (same whitespace set as \s)
+        if '  ' in cleaned or not cleaned.isprintable():
+            return ' '.join(cleaned.split())
         return cleaned.strip()
 
     def _get_default_result(self, error: str = None, code: str = None) -> Dict[str, Any]:
@@ -61,56 +306,403 @@ class OpenAIDetector:
         if not cleaned_text:
              return self._get_default_result()
         
+        cache_key = self._response_cache_key(cleaned_text)
+        cached = self._cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
+        task = self._inflight.get(cleaned_text)
+        if task is None:
+            task = asyncio.ensure_future(self._detect_cleaned(text, cleaned_text, cache_key))
+            self._inflight[cleaned_text] = task
+            task.add_done_callback(lambda _: self._inflight.pop(cleaned_text, None))
+        # shield: a cancelled caller must not cancel the call other callers are waiting on;
+        # each caller gets its own copy of the shared result
+        return copy.deepcopy(await asyncio.shield(task))
+
+    async def _detect_cleaned(self, text: str, cleaned_text: str, cache_key: bytes) -> Dict[str, Any]:
+        """Disk cache lookup, API call and error mapping for one cleaned input."""
+        cached = await self._disk_cache_get(cache_key)
+        if cached is not None:
+            return cached
+        
         try:
-            truncated_text = cleaned_text[:MAX_TEXT_LENGTH] + "..." if len(cleaned_text) > MAX_TEXT_LENGTH else cleaned_text
-            return await self._call_openai(truncated_text, text)
+            return await self._call_openai(_truncate_text(cleaned_text), text, cache_key)
+        except Exception as e:
+            return self._error_result(e)
 
-        except RateLimitError:
+    def _error_result(self, e: Exception) -> Dict[str, Any]:
+        """Map an API/internal exception to the standard error result."""
+        if isinstance(e, RateLimitError):
             return self._get_default_result("OpenAI quota exceeded.", "QUOTA_ERROR")
-        except AuthenticationError:
+        if isinstance(e, AuthenticationError):
             return self._get_default_result("Invalid API Key.", "AUTH_ERROR")
-        except APIError as e:
-            print(f"[ERROR] OpenAI API Error: {e}")
+        if isinstance(e, APIError):
+            logger.error("OpenAI API Error: %s", e)
             return self._get_default_result(f"API Error: {str(e)}", "API_ERROR")
+        logger.error("Unexpected OpenAI detector error: %s", e, exc_info=e)
+        return self._get_default_result(f"Internal Error: {str(e)}", "INTERNAL_ERROR")
+
+    async def detect_many(self, texts: List[str]) -> List[Dict[str, Any]]:
+        """
+        Run detect_country for many texts concurrently instead of awaiting them in a loop.
+        OPENAI_CONCURRENCY caps how many requests are in flight at once, and texts that clean
+        to the same input share a single call.
+
+        Args:
+            texts: Product descriptions
+
+        Returns:
+            One result per text, in input order
+        """
+        return await asyncio.gather(*[self.detect_country(text) for text in texts])
+
+    async def detect_country_batch(self, texts: List[str], batch_size: int = BATCH_MAX_ITEMS) -> List[Dict[str, Any]]:
+        """
+        Detect attributes for many descriptions, packing up to batch_size of them (and
+        BATCH_MAX_CHARS of input) into each request. Fewer, larger requests raise throughput
+        when the account is request-rate bound; cached inputs never reach the API.
+
+        Args:
+            texts: Product descriptions
+            batch_size: Max descriptions per request
+
+        Returns:
+            One result per text, in input order (same shape as detect_country)
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        cache_keys: Dict[int, bytes] = {}
+        chunks: List[List[Dict[str, Any]]] = []
+        chunk: List[Dict[str, Any]] = []
+        chunk_chars = 0
+        
+        for i, text in enumerate(texts):
+            cleaned_text = self._clean_text(text) if text and text.strip() else ""
+            if not cleaned_text:
+                results[i] = self._get_default_result()
+                continue
+            
+            cache_keys[i] = self._response_cache_key(cleaned_text)
+            cached = self._cache_get(cache_keys[i])
+            if cached is None:
+                cached = await self._disk_cache_get(cache_keys[i])
+            if cached is not None:
+                results[i] = cached
+                continue
+            
+            entry = {"i": i, "t": _truncate_text(cleaned_text)}
+            if chunk and (len(chunk) >= batch_size or chunk_chars + len(entry["t"]) > BATCH_MAX_CHARS):
+                chunks.append(chunk)
+                chunk, chunk_chars = [], 0
+            chunk.append(entry)
+            chunk_chars += len(entry["t"])
+        if chunk:
+            chunks.append(chunk)
+        
+        outputs = await asyncio.gather(*[self._detect_chunk(c, texts, cache_keys) for c in chunks])
+        for c, chunk_results in zip(chunks, outputs):
+            for entry, result in zip(c, chunk_results):
+                results[entry["i"]] = result
+        return results
+
+    async def _detect_chunk(self, chunk: List[Dict[str, Any]], texts: List[str], cache_keys: Dict[int, bytes]) -> List[Dict[str, Any]]:
+        """
+        Run one batched request. Replies are matched to inputs by their echoed "i";
+        items missing from (or duplicated in) the reply, or cut off, are retried individually.
+        """
+        if len(chunk) == 1:
+            return [await self.detect_country(texts[chunk[0]["i"]])]
+        
+        try:
+            async with self._sem:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=[_BATCH_SYSTEM_MSG, {"role": "user", "content": _dumps(chunk).decode("utf-8")}],
+                    response_format=BATCH_RESPONSE_FORMAT,
+                    prompt_cache_key=PROMPT_CACHE_KEY + "-batch",
+                    temperature=0.0,
+                    max_tokens=MAX_OUTPUT_TOKENS * len(chunk),
+                    top_p=0.8
+                )
         except Exception as e:
-            print(f"[ERROR] Unexpected: {e}")
-            traceback.print_exc()
-            return self._get_default_result(f"Internal Error: {str(e)}", "INTERNAL_ERROR")
+            return [self._error_result(e) for _ in chunk]
+        
+        self._record_usage(response.usage)
+        content = response.choices[0].message.content if response.choices else None
+        try:
+            parsed = _loads(content.strip()) if content else None
+            entries = parsed.get("r") if isinstance(parsed, dict) else None
+        except json.JSONDecodeError as e:
+            logger.warning("Batch JSON decode failed: %s", e)
+            entries = None
+        
+        by_id: Dict[int, Dict[str, Any]] = {}
+        duplicated = set()
+        for r in entries if isinstance(entries, list) else ():
+            if isinstance(r, dict) and type(r.get("i")) is int:
+                if r["i"] in by_id:
+                    duplicated.add(r["i"])
+                by_id[r["i"]] = r
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(chunk)
+        for k, entry in enumerate(chunk):
+            if entry["i"] in by_id and entry["i"] not in duplicated:
+                results[k] = self._expand_compact(by_id[entry["i"]])
+                await self._store_result(cache_keys[entry["i"]], results[k])
+        missing = [k for k, r in enumerate(results) if r is None]
+        if missing:
+            logger.warning("Batch reply matched %d/%d inputs, retrying the rest individually", len(chunk) - len(missing), len(chunk))
+            retried = await asyncio.gather(*[self.detect_country(texts[chunk[k]["i"]]) for k in missing])
+            for k, r in zip(missing, retried):
+                results[k] = r
+        return results
+
+    def _response_cache_key(self, cleaned_text: str) -> bytes:
+        """Model and prompt version are part of the key, so a prompt change never serves stale results."""
+        return hashlib.sha256(f"{self.model}|{PROMPT_VERSION}|{cleaned_text}".encode("utf-8")).digest()
+
+    def _cache_get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        """Return a copy of a live cached result and mark it most recently used."""
+        entry = self._exact_cache.get(key)
+        if entry is None:
+            return None
+        expires_at, cached = entry
+        if expires_at <= time.monotonic():
+            del self._exact_cache[key]
+            return None
+        self._exact_cache.move_to_end(key)
+        return copy.deepcopy(cached)
+
+    def _cache_put(self, key: bytes, result: Dict[str, Any]) -> None:
+        """Remember a successful result for RESPONSE_CACHE_TTL, evicting the least recently used one when full."""
+        if "error" in result or RESPONSE_CACHE_TTL <= 0:
+            return
+        self._exact_cache[key] = (time.monotonic() + RESPONSE_CACHE_TTL, copy.deepcopy(result))
+        self._exact_cache.move_to_end(key)
+        if len(self._exact_cache) > RESPONSE_CACHE_SIZE:
+            self._exact_cache.popitem(last=False)
+
+    async def _disk_cache_get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        """Look a result up in the on-disk cache, promoting hits into the memory cache."""
+        if not RESPONSE_CACHE_DIR:
+            return None
+        cached = await asyncio.to_thread(self._read_cached, self._cache_path(key))
+        if cached is not None:
+            self._cache_put(key, cached)
+        return cached
+
+    async def _store_result(self, key: bytes, result: Dict[str, Any]) -> None:
+        """Cache a successfully parsed result in memory and, when enabled, on disk."""
+        self._cache_put(key, result)
+        if RESPONSE_CACHE_DIR:
+            entry = {
+                "inputHash": key.hex(),
+                "promptVersion": PROMPT_VERSION,
+                "modelId": self.model,
+                "response": result,
+                "createdAt": time.time(),
+                "expiresAt": time.time() + DISK_CACHE_TTL if DISK_CACHE_TTL > 0 else None
+            }
+            await asyncio.to_thread(self._write_cached, self._cache_path(key), entry)
+
+    @staticmethod
+    def _cache_path(key: bytes) -> str:
+        return os.path.join(RESPONSE_CACHE_DIR, f"{key.hex()}.json")
+
+    @staticmethod
+    def _read_cached(path: str) -> Optional[Dict[str, Any]]:
+        """Stored response, or None when the entry is missing, expired or unreadable."""
+        try:
+            with open(path, "rb") as f:
+                entry = _loads(f.read())
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable cache entry %s: %s", path, e)
+            return None
+        if not isinstance(entry, dict) or "response" not in entry:
+            return None  # Written by an older version
+        expires_at = entry.get("expiresAt")
+        if expires_at is not None and expires_at <= time.time():
+            return None
+        return entry["response"]
+
+    @staticmethod
+    def _write_cached(path: str, entry: Dict[str, Any]) -> None:
+        """Best-effort write; a temp file + rename keeps concurrent readers from seeing partial JSON."""
+        try:
+            os.makedirs(RESPONSE_CACHE_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=RESPONSE_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(_dumps(entry))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write cache entry %s: %s", path, e)
+
+    async def stream_attributes(self, text: str) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+        """
+        Opt-in streaming variant of detect_country: yields (name, attribute) pairs as soon as
+        each attribute's object is complete in the streamed reply, so callers can act on
+        "country" before "size"/"material" have been generated. detect_country keeps the
+        buffered single-response path.
+
+        Args:
+            text: Product description
 
-    async def _call_openai(self, text_for_prompt: str, original_text: str) -> Dict[str, Any]:
-        """Handle API call and parsing."""
-        response = await self.client.chat.completions.create(
+        Yields:
+            ("country" | "size" | "material", attribute dict), each name exactly once.
+            API errors propagate to the caller; a cut-off reply yields the regex fallback
+            for the attributes that had not arrived yet.
+
+        The concurrency slot and the HTTP stream are held while the reply streams, including
+        while the caller handles a yielded pair. A caller that stops early should close the
+        generator (contextlib.aclosing) so both are released then rather than at garbage collection.
+        """
+        cleaned_text = self._clean_text(text) if text and text.strip() else ""
+        if not cleaned_text:
+            for name, attr in self._get_default_result()["attributes"].items():
+                yield name, attr
+            return
+        
+        cache_key = self._response_cache_key(cleaned_text)
+        cached = self._cache_get(cache_key)
+        if cached is None:
+            cached = await self._disk_cache_get(cache_key)
+        if cached is not None:
+            for name, attr in cached["attributes"].items():
+                yield name, attr
+            return
+        
+        truncated_text = _truncate_text(cleaned_text)
+        scanner = _CompactAttrScanner()
+        pending = {name for _, name in _COMPACT_ATTRS}
+        async with self._sem:
+            stream = await self.client.chat.completions.create(
+                **self._request_kwargs(truncated_text), stream=True, stream_options={"include_usage": True}
+            )
+            async with stream:
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        self._record_usage(chunk.usage)
+                    if not chunk.choices or not chunk.choices[0].delta.content:
+                        continue
+                    for member in scanner.feed(chunk.choices[0].delta.content):
+                        name, attr = self._member_attribute(member)
+                        if name in pending:
+                            pending.discard(name)
+                            yield name, attr
+        
+        try:
+            result = self._parse_json_response(scanner.buffer.strip())
+        except json.JSONDecodeError:
+            # Only reachable when the reply was cut off at max_tokens
+            logger.debug("Streamed JSON incomplete, using heuristic fallback")
+            fallback = self._heuristic_fallback(text)["attributes"]
+            for name in (name for _, name in _COMPACT_ATTRS if name in pending):
+                yield name, fallback[name]
+            return
+        await self._store_result(cache_key, result)
+
+    @staticmethod
+    def _record_usage(usage: Any) -> None:
+        """Count prompt, cached-prompt and completion tokens of one reply (no-op without usage)."""
+        if usage is None:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+        OPENAI_TOKENS.labels('prompt').inc(usage.prompt_tokens or 0)
+        OPENAI_TOKENS.labels('cached_prompt').inc(cached)
+        OPENAI_TOKENS.labels('completion').inc(usage.completion_tokens or 0)
+        logger.debug(
+            "OpenAI usage: prompt=%s cached=%s (%.0f%%) completion=%s",
+            usage.prompt_tokens, cached, 100.0 * cached / max(usage.prompt_tokens or 0, 1), usage.completion_tokens
+        )
+
+    def _request_kwargs(self, text_for_prompt: str) -> Dict[str, Any]:
+        """Chat completion arguments shared by the buffered and streaming paths."""
+        return dict(
             model=self.model,
             messages=[
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": f"この商品説明を分析し、構造化JSONを返却してください。\n\n商品説明:\n{text_for_prompt}\n\n出力JSON:"}
+                _SYSTEM_MSG,
+                # Static instructions live in SYSTEM_PROMPT so the cached prefix covers them
+                {"role": "user", "content": text_for_prompt}
             ],
+            response_format=RESPONSE_FORMAT,
+            prompt_cache_key=PROMPT_CACHE_KEY,
             temperature=0.0,
-            max_tokens=400,
+            max_tokens=MAX_OUTPUT_TOKENS,
             top_p=0.8
         )
+
+    async def _call_openai(self, text_for_prompt: str, original_text: str, cache_key: Optional[bytes] = None) -> Dict[str, Any]:
+        """Handle API call and parsing; successfully parsed results are cached under cache_key when given."""
+        async with self._sem:
+            response = await self.client.chat.completions.create(**self._request_kwargs(text_for_prompt))
+        self._record_usage(response.usage)
         
         if not response.choices or not response.choices[0].message.content:
             return self._get_default_result()
 
-        raw_content = response.choices[0].message.content.strip()
+        choice = response.choices[0]
+        # Structured outputs guarantee schema-valid JSON for a completed reply; only one that
+        # stopped early (max_tokens, content filter) can be partial, so that is checked up front
+        if choice.finish_reason != "stop":
+            logger.debug("Reply ended with finish_reason=%s, salvaging partial JSON", choice.finish_reason)
+            return self._salvage_partial(choice.message.content, original_text)
         
-        try:
-            return self._parse_json_response(raw_content)
-        except json.JSONDecodeError:
-            print(f"[DEBUG] JSON parse failed, using heuristic fallback.")
-            return self._heuristic_fallback(original_text)
+        result = self._parse_json_response(choice.message.content)
+        
+        if cache_key is not None:
+            await self._store_result(cache_key, result)
+        return result
+
+    def _member_attribute(self, member: str) -> Tuple[Optional[str], Dict[str, Any]]:
+        """Expand one closed '"<key>":{...}' member of a compact reply to (name, attribute)."""
+        # Keys are plain short names, no escapes
+        name = _COMPACT_NAMES.get(member[1:member.find('"', 1)])
+        if name is None:
+            return None, {}
+        return name, self._parse_json_response("{" + member + "}")["attributes"][name]
+
+    def _salvage_partial(self, partial: str, original_text: str) -> Dict[str, Any]:
+        """
+        Result for a reply cut off mid-JSON: attributes whose objects closed before the cut
+        are kept as the model wrote them, only the rest come from the regex fallback.
+        """
+        closed: Dict[str, Dict[str, Any]] = {}
+        for member in _CompactAttrScanner().feed(partial):
+            name, attr = self._member_attribute(member)
+            if name is not None:
+                closed.setdefault(name, attr)
+        if len(closed) == len(_COMPACT_ATTRS):
+            return {"attributes": closed}
+        fallback = self._heuristic_fallback(original_text)["attributes"]
+        return {"attributes": {name: closed.get(name) or fallback[name] for _, name in _COMPACT_ATTRS}}
 
     def _parse_json_response(self, raw_text: str) -> Dict[str, Any]:
-        """Parse JSON and ensure structure."""
-        parsed = json.loads(raw_text)
-        attributes = parsed.get("attributes", DEFAULT_ATTRIBUTES.copy())
+        """Parse the compact JSON reply and expand it to the public {"attributes": ...} shape."""
+        return self._expand_compact(_loads(raw_text))
+
+    def _expand_compact(self, parsed: Dict[str, Any]) -> Dict[str, Any]:
+        """Expand one compact {"c", "s", "m"} object to the public {"attributes": ...} shape."""
+        attributes = {}
+        for short, name in _COMPACT_ATTRS:
+            attr = parsed.get(short)
+            if isinstance(attr, dict):
+                attributes[name] = {"value": attr.get("v"), "evidence": attr.get("e", ""), "confidence": attr.get("cf", 0.0)}
+            else:
+                attributes[name] = dict(DEFAULT_ATTRIBUTES[name])
         
         # Normalize country value to list if it's a string
-        country_attr = attributes.get('country', {})
-        if isinstance(country_attr.get('value'), str):
+        country_attr = attributes['country']
+        if isinstance(country_attr['value'], str):
             country_attr['value'] = [country_attr['value']]
-            attributes['country'] = country_attr
+        # Names the model left unnormalized ("Scotland") resolve client-side
+        if isinstance(country_attr['value'], list):
+            country_attr['value'] = [
+                (country_name_to_alpha2(v) or v) if isinstance(v, str) and not (len(v) == 2 and v.isascii()) else v
+                for v in country_attr['value']
+            ]
             
         return {"attributes": attributes}
 
@@ -118,33 +710,41 @@ class OpenAIDetector:
         """Regex-based fallback when LLM fails."""
         attributes = DEFAULT_ATTRIBUTES.copy()
         
+        # Scan the lowercased text case-sensitively and slice groups out of the original by
+        # position. Rare text where that could differ from IGNORECASE (lower() changing the
+        # length, as for 'İ', or re folding 'ı'/'ſ' onto i/s) scans the original instead
+        haystack = text.lower()
+        patterns = _FALLBACK_PATTERNS_LC
+        if len(haystack) != len(text) or 'ı' in haystack or 'ſ' in haystack:
+            haystack, patterns = text, _FALLBACK_PATTERNS_CI
+        country_re, size_re, material_re, material_word_re = patterns
+        
+        def group(match: "re.Match[str]", n: int) -> str:
+            return text[match.start(n):match.end(n)]
+        
         # Country detection
-        country_match = re.search(r'((?:made\s+in|原産国|製造国)[\s:]*([A-Za-z\u3040-\u30ff\u4e00-\u9fff]+))', text, re.IGNORECASE)
+        country_match = country_re.search(haystack)
         if country_match:
-            c_name = country_match.group(2).upper()
-            code = "ZZ"
-            # Simple mapping (Extensible)
-            if "JAPAN" in c_name or "日本" in c_name: code = "JP"
-            elif "CHINA" in c_name or "中国" in c_name: code = "CN"
-            elif "VIETNAM" in c_name or "ベトナム" in c_name: code = "VN"
-            elif "INDONESIA" in c_name: code = "ID"
+            c_name = group(country_match, 2)
+            # Exact name first, then any known name inside the word (日本製, Japanese)
+            code = country_name_to_alpha2(c_name) or find_country_name(c_name)
             
-            if code != "ZZ":
-                attributes["country"] = {"value": [code], "evidence": country_match.group(1), "confidence": 0.3}
+            if code:
+                attributes["country"] = {"value": [code], "evidence": group(country_match, 1), "confidence": 0.3}
 
         # Size detection
-        size_match = re.search(r'((?:size|サイズ)[\s:/]*([A-Za-z0-9/ cmMLXS.]+))', text, re.IGNORECASE)
+        size_match = size_re.search(haystack)
         if size_match:
-            attributes["size"] = {"value": size_match.group(2).strip(), "evidence": size_match.group(1).strip(), "confidence": 0.3}
+            attributes["size"] = {"value": group(size_match, 2).strip(), "evidence": group(size_match, 1).strip(), "confidence": 0.3}
 
         # Material detection
-        mat_match = re.search(r'((?:material|素材|材料)[\s:]*([A-Za-z\u3040-\u30ff\u4e00-\u9fff0-9％/・]+))', text, re.IGNORECASE)
+        mat_match = material_re.search(haystack)
         if not mat_match:
-            mat_match = re.search(r'(カシミヤ|cashmere|cotton|wool)', text, re.IGNORECASE)
+            mat_match = material_word_re.search(haystack)
             
         if mat_match:
-             val = mat_match.group(2) if len(mat_match.groups()) > 1 else mat_match.group(1)
-             evidence = mat_match.group(0) # simplified
+             val = group(mat_match, 2) if len(mat_match.groups()) > 1 else group(mat_match, 1)
+             evidence = group(mat_match, 0) # simplified
              attributes["material"] = {"value": val.strip(), "evidence": evidence.strip(), "confidence": 0.3}
 
         return {"attributes": attributes}
\ No newline at end of file
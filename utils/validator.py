@@ -1,9 +1,9 @@
 import re
-from typing import List, Set
-from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional
 
 # Constants
 UNKNOWN_COUNTRY_CODE = "ZZZ"
+_NON_ALPHA_RE = re.compile(r'[^A-Z]')
 
 # Mapping from alpha-2 to alpha-3 codes (ISO 3166-1)
 ALPHA2_TO_ALPHA3 = {
@@ -37,15 +37,183 @@ ALPHA2_TO_ALPHA3 = {
 }
 
 # Valid ISO 3166-1 alpha-3 codes
-VALID_COUNTRY_CODES: Set[str] = set(ALPHA2_TO_ALPHA3.values())
+VALID_COUNTRY_CODES: FrozenSet[str] = frozenset(ALPHA2_TO_ALPHA3.values())
+
+# Country names (lowercase English / Japanese / Chinese, plus common aliases) -> alpha-2.
+# Lets a detector's raw name ("Scotland", "日本") resolve deterministically instead of
+# relying on the model to normalize it.
+_COUNTRY_NAMES: Dict[str, tuple] = {
+    # Asia
+    "JP": ("japan", "日本", "日本国"),
+    "CN": ("china", "prc", "mainland china", "people's republic of china", "中国", "中國", "中华人民共和国", "中華人民共和国"),
+    "KR": ("korea", "south korea", "republic of korea", "韓国", "大韓民国", "韩国"),
+    "VN": ("vietnam", "viet nam", "ベトナム", "越南"),
+    "TH": ("thailand", "タイ", "泰国"),
+    "TW": ("taiwan", "台湾", "臺灣"),
+    "HK": ("hong kong", "香港"),
+    "SG": ("singapore", "シンガポール", "新加坡"),
+    "MY": ("malaysia", "マレーシア", "马来西亚"),
+    "ID": ("indonesia", "インドネシア", "印度尼西亚"),
+    "PH": ("philippines", "フィリピン", "菲律宾"),
+    "IN": ("india", "インド", "印度"),
+    "BD": ("bangladesh", "バングラデシュ", "孟加拉国"),
+    "PK": ("pakistan", "パキスタン"),
+    "MM": ("myanmar", "burma", "ミャンマー", "缅甸"),
+    "KH": ("cambodia", "カンボジア", "柬埔寨"),
+    "LA": ("laos", "ラオス"),
+    "BN": ("brunei",),
+    "MO": ("macau", "macao", "マカオ", "澳门"),
+    "MN": ("mongolia", "モンゴル"),
+    "NP": ("nepal", "ネパール"),
+    "LK": ("sri lanka", "スリランカ"),
+    # Americas
+    "US": ("united states", "united states of america", "america", "usa", "u.s.a.", "u.s.", "puerto rico",
+           "アメリカ", "米国", "アメリカ合衆国", "美国"),
+    "CA": ("canada", "カナダ", "加拿大"),
+    "MX": ("mexico", "メキシコ", "墨西哥"),
+    "BR": ("brazil", "ブラジル", "巴西"),
+    "AR": ("argentina", "アルゼンチン"),
+    "CL": ("chile", "チリ"),
+    "CO": ("colombia", "コロンビア"),
+    "PE": ("peru", "ペルー", "秘鲁"),
+    "VE": ("venezuela",),
+    "EC": ("ecuador", "エクアドル"),
+    "BO": ("bolivia", "ボリビア"),
+    "PY": ("paraguay",),
+    "UY": ("uruguay",),
+    "CR": ("costa rica",),
+    "PA": ("panama",),
+    "GT": ("guatemala", "グアテマラ"),
+    "HN": ("honduras", "ホンジュラス"),
+    "NI": ("nicaragua",),
+    "SV": ("el salvador",),
+    "CU": ("cuba",),
+    "DO": ("dominican republic",),
+    "JM": ("jamaica",),
+    # Europe
+    "GB": ("united kingdom", "uk", "u.k.", "great britain", "britain", "england", "scotland", "wales",
+           "northern ireland", "イギリス", "英国", "英國"),
+    "DE": ("germany", "ドイツ", "德国"),
+    "FR": ("france", "フランス", "法国"),
+    "IT": ("italy", "イタリア", "意大利"),
+    "ES": ("spain", "スペイン", "西班牙"),
+    "NL": ("netherlands", "the netherlands", "holland", "オランダ", "荷兰"),
+    "BE": ("belgium", "ベルギー"),
+    "CH": ("switzerland", "スイス", "瑞士"),
+    "AT": ("austria", "オーストリア"),
+    "SE": ("sweden", "スウェーデン"),
+    "NO": ("norway", "ノルウェー"),
+    "DK": ("denmark", "デンマーク"),
+    "FI": ("finland", "フィンランド"),
+    "PL": ("poland", "ポーランド"),
+    "CZ": ("czech republic", "czechia", "チェコ"),
+    "HU": ("hungary", "ハンガリー"),
+    "PT": ("portugal", "ポルトガル", "葡萄牙"),
+    "GR": ("greece", "ギリシャ"),
+    "RO": ("romania", "ルーマニア"),
+    "IE": ("ireland", "アイルランド"),
+    "UA": ("ukraine", "ウクライナ"),
+    "RU": ("russia", "russian federation", "ロシア", "俄罗斯"),
+    # Middle East
+    "AE": ("united arab emirates", "uae", "アラブ首長国連邦"),
+    "SA": ("saudi arabia", "サウジアラビア"),
+    "IL": ("israel", "イスラエル"),
+    "TR": ("turkey", "türkiye", "turkiye", "トルコ", "土耳其"),
+    "IR": ("iran", "イラン"),
+    "IQ": ("iraq",),
+    "JO": ("jordan", "ヨルダン"),
+    "LB": ("lebanon",),
+    "KW": ("kuwait",),
+    "QA": ("qatar",),
+    "OM": ("oman",),
+    "BH": ("bahrain",),
+    "YE": ("yemen",),
+    "SY": ("syria",),
+    "PS": ("palestine",),
+    # Africa
+    "ZA": ("south africa", "南アフリカ"),
+    "EG": ("egypt", "エジプト", "埃及"),
+    "NG": ("nigeria",),
+    "KE": ("kenya", "ケニア"),
+    "GH": ("ghana", "ガーナ"),
+    "TZ": ("tanzania",),
+    "UG": ("uganda",),
+    "ET": ("ethiopia", "エチオピア"),
+    "MA": ("morocco", "モロッコ"),
+    "DZ": ("algeria",),
+    "TN": ("tunisia", "チュニジア"),
+    "SD": ("sudan",),
+    "AO": ("angola",),
+    "MZ": ("mozambique",),
+    "ZW": ("zimbabwe",),
+    "ZM": ("zambia",),
+    "MW": ("malawi",),
+    "BW": ("botswana",),
+    "NA": ("namibia",),
+    # Oceania
+    "AU": ("australia", "オーストラリア", "澳大利亚"),
+    "NZ": ("new zealand", "ニュージーランド", "新西兰"),
+    "FJ": ("fiji",),
+    "PG": ("papua new guinea",),
+    "NC": ("new caledonia",),
+    "PF": ("french polynesia",),
+    "WS": ("samoa",),
+    "TO": ("tonga",),
+    "VU": ("vanuatu",),
+    "SB": ("solomon islands",),
+    "GU": ("guam",),
+}
+COUNTRY_NAME_TO_ALPHA2: Dict[str, str] = {
+    name: alpha2 for alpha2, names in _COUNTRY_NAMES.items() for name in names
+}
+
+
+def country_name_to_alpha2(name: str) -> Optional[str]:
+    """Resolve a country name or alias ("Scotland", "日本") to its alpha-2 code, else None."""
+    if not name:
+        return None
+    return COUNTRY_NAME_TO_ALPHA2.get(name.strip().lower())
+
+
+# Every name/alias in one alternation, longest first so "インドネシア" wins over "インド" at the
+# same position. ASCII names must stand as their own word ("oman" not inside "woman", "uk" not
+# inside "ukrainian"), optionally with a demonym ending ("japanese", "omani"); the boundaries
+# only look at ASCII letters/digits so "japan製" still matches. CJK names match anywhere ("日本製")
+_SCAN_NAMES = sorted(COUNTRY_NAME_TO_ALPHA2, key=len, reverse=True)
+_COUNTRY_NAME_SCAN_RE = re.compile(
+    r"(?<![a-z0-9])(" + "|".join(re.escape(n) for n in _SCAN_NAMES if n.isascii()) + r")(?:ese|ian|n|i)?(?![a-z0-9])"
+    + "|(" + "|".join(re.escape(n) for n in _SCAN_NAMES if not n.isascii()) + ")"
+)
+
+
+def find_country_name(text: str) -> Optional[str]:
+    """Alpha-2 code of the first country name found in text ("日本製", "Japanese", "USA"), else None."""
+    if not text:
+        return None
+    match = _COUNTRY_NAME_SCAN_RE.search(text.lower())
+    return COUNTRY_NAME_TO_ALPHA2[match.group(1) or match.group(2)] if match else None
 
 def _normalize_code(code: str) -> str:
     """Normalize input string to uppercase code (2 or 3 letters)."""
     if not code:
         return UNKNOWN_COUNTRY_CODE
     
-    # Remove non-alphabet characters and uppercase
-    clean_code = re.sub(r'[^A-Z]', '', code.strip().upper())
+    # Fast path: model output is almost always an exact code ("JP", "jpn").
+    # No name/alias spells a different country's code, so checking these first is safe
+    clean_code = code.strip().upper()
+    if len(clean_code) == 2 and clean_code in ALPHA2_TO_ALPHA3:
+        return ALPHA2_TO_ALPHA3[clean_code]
+    if clean_code in VALID_COUNTRY_CODES:
+        return clean_code
+    
+    # Full country names / aliases next (their letters would not form a valid code)
+    alpha2 = country_name_to_alpha2(code)
+    if alpha2:
+        return ALPHA2_TO_ALPHA3[alpha2]
+    
+    # Remove non-alphabet characters (codes are usually clean already)
+    if not (clean_code.isascii() and clean_code.isalpha()):
+        clean_code = _NON_ALPHA_RE.sub('', clean_code)
     
     # Accept both 2-char (alpha-2) and 3-char (alpha-3) codes
     if len(clean_code) == 2:
@@ -70,13 +238,14 @@ def validate_countries(codes: List[str]) -> List[str]:
     if not codes:
         return []
     
-    validated = []
-    for code in codes:
+    # Repeated raw codes (["JP", "JP"]) are validated once; different spellings of the
+    # same country ("JP", "jpn") still collapse on the validated code. Order is preserved
+    unique_codes = []
+    seen = set()
+    for code in dict.fromkeys(codes):
         valid_code = validate_country_code(code)
-        if valid_code != UNKNOWN_COUNTRY_CODE:
-            validated.append(valid_code)
-    
-    # Remove duplicates while preserving order using OrderedDict
-    unique_codes = list(OrderedDict.fromkeys(validated))
+        if valid_code != UNKNOWN_COUNTRY_CODE and valid_code not in seen:
+            seen.add(valid_code)
+            unique_codes.append(valid_code)
     
-    return unique_codes if unique_codes else []
+    return unique_codes